@@ -0,0 +1,200 @@
+"""Throughput, latency and memory benchmark for VoikkoLemmatizer.
+
+Runs the lemmatizer on the bundled sample in several configurations
+and writes the results as JSON. Each configuration is measured with a
+cold cache (a new lemmatizer instance) and with a warm cache (the same
+instance on the following passes).
+
+Example:
+
+    python -m benchmarks.lemmatizer --output metrics/benchmarks/lemmatizer.json
+"""
+
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import spacy
+import typer
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+from spacy.lang.fi import Finnish
+from fi.fi import (
+    AnalysisStore,
+    LemmaTable,
+    VoikkoLemmatizer,
+    create_lookups_from_json_reader,
+    get_voikko_pool,
+    parse_analysis_structure,
+)
+from .sample import make_docs, read_sample
+
+LOOKUPS_PATH = Path(__file__).parent.parent / 'fi' / 'lookups' / 'lemmatizer'
+
+# Name -> (lemmatizer options, initialization data, batch size)
+CONFIGURATIONS = {
+    'voikko': ({}, [], 1),
+    'voikko-pipe': ({}, [], 128),
+    'voikko-no-caches': ({'analysis_cache_size': 0, 'lemma_cache_size': 0}, [], 1),
+    'voikko-fifo': ({'analysis_cache_policy': 'fifo'}, [], 1),
+    'voikko-analysis-store': ({}, ['analysis_store'], 1),
+    'voikko-stats': ({'collect_stats': True}, [], 1),
+    'lookup': ({'mode': 'lookup'}, ['lemma_table'], 1),
+}
+
+
+def main(
+    output_path: Path = typer.Option(..., '--output', help='Name of the output JSON file'),
+    configurations: Optional[List[str]] = typer.Option(
+        None, '--config', help='Configurations to run. Defaults to all'),
+    warm_passes: int = typer.Option(20, help='Number of passes over the sample with a warm cache'),
+    rounds: int = typer.Option(5, help='Number of cold cache measurements'),
+):
+    configurations = configurations or list(CONFIGURATIONS)
+    unknown = set(configurations) - set(CONFIGURATIONS)
+    if unknown:
+        raise typer.BadParameter(f'Unknown configurations: {", ".join(sorted(unknown))}')
+
+    nlp = Finnish()
+    sentences = read_sample()
+    lookups = create_lookups_from_json_reader(LOOKUPS_PATH)
+    data = {
+        'analysis_store': build_analysis_store(sentences),
+        'lemma_table': build_lemma_table(nlp, lookups, sentences),
+    }
+
+    results = []
+    for name in configurations:
+        options, initialize_data, batch_size = CONFIGURATIONS[name]
+
+        def create_lemmatizer():
+            lemmatizer = VoikkoLemmatizer(nlp.vocab, **options)
+            lemmatizer.initialize(lookups=lookups, **{k: data[k] for k in initialize_data})
+            # Exclude shared state from the cold cache measurements
+            parse_analysis_structure.cache_clear()
+            return lemmatizer
+
+        cold_timings = []
+        for _ in range(rounds):
+            lemmatizer = create_lemmatizer()
+            cold_timings.extend(run(lemmatizer, nlp, sentences, batch_size))
+
+        warm_timings = []
+        for _ in range(warm_passes):
+            warm_timings.extend(run(lemmatizer, nlp, sentences, batch_size))
+
+        tracemalloc.start()
+        run(create_lemmatizer(), nlp, sentences, batch_size)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        result = {
+            'config': name,
+            'options': options,
+            'data': initialize_data,
+            'batch_size': batch_size,
+            'cold': summarize(cold_timings),
+            'warm': summarize(warm_timings),
+            'peak_memory_bytes': peak_memory,
+        }
+        if lemmatizer.collect_stats:
+            result['stats'] = lemmatizer.stats()
+        results.append(result)
+
+        print(f'{name}: cold {result["cold"]["tokens_per_second"]:.0f} tokens/s, '
+              f'warm {result["warm"]["tokens_per_second"]:.0f} tokens/s, '
+              f'peak memory {peak_memory / 1024:.0f} KiB')
+
+    output = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'spacy': spacy.__version__,
+        'sample_sentences': len(sentences),
+        'sample_tokens': sum(len(s.words) for s in sentences),
+        'results': results,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(output, f, indent=2)
+
+
+def run(lemmatizer, nlp, sentences, batch_size):
+    """Lemmatize the sample once and return (number of tokens, seconds)
+    for each doc (batch_size == 1) or for each batch.
+    """
+    docs = make_docs(nlp.vocab, sentences)
+    timings = []
+    if batch_size == 1:
+        for doc in docs:
+            start = time.perf_counter()
+            lemmatizer(doc)
+            timings.append((len(doc), time.perf_counter() - start))
+    else:
+        for i in range(0, len(docs), batch_size):
+            batch = docs[i:i + batch_size]
+            start = time.perf_counter()
+            for _ in lemmatizer.pipe(batch, batch_size=batch_size):
+                pass
+            timings.append((sum(len(d) for d in batch), time.perf_counter() - start))
+    return timings
+
+
+def summarize(timings) -> Dict[str, float]:
+    num_tokens = np.array([n for n, _ in timings])
+    seconds = np.array([s for _, s in timings])
+    per_token_us = seconds / num_tokens * 1e6
+    return {
+        'tokens': int(num_tokens.sum()),
+        'seconds': float(seconds.sum()),
+        'tokens_per_second': float(num_tokens.sum() / seconds.sum()),
+        'latency_per_token_us': {
+            'p50': float(np.percentile(per_token_us, 50)),
+            'p90': float(np.percentile(per_token_us, 90)),
+            'p99': float(np.percentile(per_token_us, 99)),
+            'max': float(per_token_us.max()),
+        },
+    }
+
+
+def build_analysis_store(sentences):
+    pool = get_voikko_pool('fi')
+    words = set()
+    for s in sentences:
+        for w in s.words:
+            if '-' in w and w[-1] != '-':
+                w = w.rsplit('-', 1)[-1]
+            words.add(w)
+    return AnalysisStore.build((w, pool.analyze(w)) for w in sorted(words))
+
+
+def build_lemma_table(nlp, lookups, sentences):
+    """Create a lemma table from the Voikko lemmas of the sample."""
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=lookups)
+    table = LemmaTable()
+    keys = set()
+    for doc in make_docs(nlp.vocab, sentences):
+        for token in lemmatizer(doc):
+            key = (token.orth_, token.pos_, lemmatizer.dep_class(token))
+            if token.pos_ not in ('PUNCT', 'SPACE') and key not in keys:
+                keys.add(key)
+                table.add(*key, token.lemma_)
+    return table
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -0,0 +1,55 @@
+"""The bundled Finnish benchmark sample.
+
+The sample is a small CoNLL-U file with gold POS tags and dependency
+trees. The docs are constructed with the annotations already set so
+that the benchmarks can run without a trained model.
+"""
+
+from pathlib import Path
+from typing import List, NamedTuple
+from spacy.tokens import Doc
+from spacy.vocab import Vocab
+
+SAMPLE_PATH = Path(__file__).parent / 'data' / 'sample.conllu'
+
+
+class Sentence(NamedTuple):
+    text: str
+    words: List[str]
+    spaces: List[bool]
+    pos: List[str]
+    heads: List[int]
+    deps: List[str]
+
+
+def read_sample(path: Path = SAMPLE_PATH) -> List[Sentence]:
+    sentences = []
+    with open(path, encoding='utf-8') as f:
+        for block in f.read().strip().split('\n\n'):
+            text = ''
+            rows = []
+            for line in block.split('\n'):
+                if line.startswith('# text = '):
+                    text = line[len('# text = '):]
+                elif not line.startswith('#'):
+                    rows.append(line.split('\t'))
+
+            sentences.append(Sentence(
+                text=text,
+                words=[x[1] for x in rows],
+                spaces=['SpaceAfter=No' not in x[9] for x in rows],
+                pos=[x[3] for x in rows],
+                # CoNLL-U heads are 1-based and 0 is the root. spaCy
+                # expects the root to be its own head.
+                heads=[int(x[6]) - 1 if x[6] != '0' else i for i, x in enumerate(rows)],
+                deps=['ROOT' if x[7] == 'root' else x[7] for x in rows],
+            ))
+
+    return sentences
+
+
+def make_docs(vocab: Vocab, sentences: List[Sentence]) -> List[Doc]:
+    return [
+        Doc(vocab, words=s.words, spaces=s.spaces, pos=s.pos, heads=s.heads, deps=s.deps)
+        for s in sentences
+    ]
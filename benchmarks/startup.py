@@ -0,0 +1,124 @@
+"""Import and construction time benchmark for FinnishExtended.
+
+Each measurement runs in a new Python process. The construction of
+FinnishExtended and the first tokenizer call are measured without the
+disk cache of compiled tokenizer expressions (the default), and with an
+empty and with a populated cache in SPACYFI_CACHE_DIR. The rebuild time
+is the time of creating a new tokenizer in a process that has already
+created one, like tools/tokenize_fi.py does periodically.
+
+Example:
+
+    python -m benchmarks.startup --output metrics/benchmarks/startup.json
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import spacy
+import typer
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+from .lemmatizer import git_commit
+
+ROOT = Path(__file__).parent.parent
+
+MEASURE_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from fi import FinnishExtended
+import_seconds = time.perf_counter() - start
+start = time.perf_counter()
+nlp = FinnishExtended()
+construct_seconds = time.perf_counter() - start
+start = time.perf_counter()
+nlp.tokenizer("Tämä on ensimmäinen lause, ks. www.example.com (12.3.2024).")
+first_call_seconds = time.perf_counter() - start
+rebuild_seconds = []
+for _ in range({rebuilds}):
+    start = time.perf_counter()
+    FinnishExtended().tokenizer
+    rebuild_seconds.append(time.perf_counter() - start)
+print(json.dumps({{
+    "import": import_seconds,
+    "construct": construct_seconds,
+    "first_call": first_call_seconds,
+    "rebuild": rebuild_seconds,
+}}))
+"""
+
+
+def main(
+    output_path: Path = typer.Option(..., '--output', help='Name of the output JSON file'),
+    rounds: int = typer.Option(5, help='Number of processes for each configuration'),
+    rebuilds: int = typer.Option(10, help='Number of tokenizer rebuilds in each process'),
+):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = Path(tmp_dir)
+        # Name -> (SPACYFI_CACHE_DIR, clear the cache before each round)
+        configurations = {
+            'no-cache': ('', False),
+            'cold-cache': (str(cache_dir), True),
+            'warm-cache': (str(cache_dir), False),
+        }
+        for name, (cache_setting, clear) in configurations.items():
+            measurements = []
+            for _ in range(rounds):
+                if clear:
+                    for p in cache_dir.glob('regex-*'):
+                        p.unlink()
+                measurements.append(measure(cache_setting, rebuilds))
+
+            result = {
+                'config': name,
+                'import_seconds': summarize([m['import'] for m in measurements]),
+                'construct_seconds': summarize([m['construct'] for m in measurements]),
+                'first_call_seconds': summarize([m['first_call'] for m in measurements]),
+                'rebuild_seconds': summarize([x for m in measurements for x in m['rebuild']]),
+            }
+            results.append(result)
+
+            print(f'{name}: import {result["import_seconds"]["median"] * 1000:.0f} ms, '
+                  f'construct {result["construct_seconds"]["median"] * 1000:.0f} ms, '
+                  f'first call {result["first_call_seconds"]["median"] * 1000:.1f} ms, '
+                  f'rebuild {result["rebuild_seconds"]["median"] * 1000:.0f} ms')
+
+    output = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'spacy': spacy.__version__,
+        'results': results,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(output, f, indent=2)
+
+
+def measure(cache_setting: str, rebuilds: int) -> Dict:
+    """Measure the timings in a new process."""
+    env = dict(os.environ, SPACYFI_CACHE_DIR=cache_setting)
+    completed = subprocess.run(
+        [sys.executable, '-c', MEASURE_SCRIPT.format(rebuilds=rebuilds)],
+        capture_output=True, text=True, check=True, cwd=ROOT, env=env,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    seconds = np.array(seconds)
+    return {
+        'median': float(np.median(seconds)),
+        'min': float(seconds.min()),
+        'max': float(seconds.max()),
+    }
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -0,0 +1,134 @@
+"""Throughput benchmark for the tokenizer.
+
+Tokenizes texts with new tokenizers in several configurations: the
+combined prefix, suffix and infix regular expressions (regex), the
+AffixMatcher of the default tokenizer (default) and the default
+tokenizer with an affix table (affix-table). The first pass over the
+texts is measured with a new tokenizer (cold cache) and the following
+passes with the same tokenizer (warm cache). The affix table is built
+from the most frequent chunks in the word frequency list or, if no list
+is given, in the texts.
+
+Example:
+
+    python -m benchmarks.tokenizer --texts corpus/mc4/mc4_200000.jsonl --output metrics/benchmarks/tokenizer.json
+"""
+
+import json
+import platform
+import time
+import spacy
+import srsly
+import typer
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from spacy import util
+from fi.fi import AffixTable, FinnishExtended
+from tools.create_affix_table import read_chunks
+from .lemmatizer import git_commit
+from .sample import read_sample
+
+
+def main(
+    output_path: Path = typer.Option(..., '--output', help='Name of the output JSON file'),
+    texts_path: Optional[Path] = typer.Option(
+        None, '--texts', help='JSONL file with a "text" field on each line. Defaults to the bundled sample'),
+    vocabulary_path: Optional[Path] = typer.Option(
+        None, '--vocabulary', help='Word frequency list for the affix table'),
+    max_texts: int = typer.Option(10000, help='Maximum number of texts to read'),
+    table_size: int = typer.Option(100000, help='Number of most frequent tokens in the affix table'),
+    warm_passes: int = typer.Option(3, help='Number of passes over the texts with a warm cache'),
+    rounds: int = typer.Option(3, help='Number of cold cache measurements'),
+):
+    texts = read_texts(texts_path, max_texts)
+    if vocabulary_path is not None:
+        chunks = read_chunks(vocabulary_path, table_size, '.,')
+    else:
+        counts = Counter(chunk for text in texts for chunk in text.split())
+        chunks = [chunk for chunk, _ in counts.most_common(table_size)]
+    affix_table = AffixTable.build(FinnishExtended().tokenizer, chunks)
+
+    def create_tokenizer_with_table():
+        tokenizer = FinnishExtended().tokenizer
+        tokenizer.affix_table = affix_table
+        return tokenizer
+
+    def create_regex_tokenizer():
+        nlp = FinnishExtended()
+        return util.registry.tokenizers.get('spacyfi.CachedTokenizer.v1')()(nlp)
+
+    # Name -> tokenizer factory
+    configurations: Dict[str, Callable] = {
+        'regex': create_regex_tokenizer,
+        'default': lambda: FinnishExtended().tokenizer,
+        'affix-table': create_tokenizer_with_table,
+    }
+
+    results = []
+    for name, create_tokenizer in configurations.items():
+        cold_timings = []
+        for _ in range(rounds):
+            tokenizer = create_tokenizer()
+            cold_timings.append(run(tokenizer, texts))
+
+        warm_timings = [run(tokenizer, texts) for _ in range(warm_passes)]
+
+        result = {
+            'config': name,
+            'cold': summarize(cold_timings),
+            'warm': summarize(warm_timings),
+        }
+        results.append(result)
+
+        print(f'{name}: cold {result["cold"]["tokens_per_second"]:.0f} tokens/s, '
+              f'warm {result["warm"]["tokens_per_second"]:.0f} tokens/s')
+
+    output = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'spacy': spacy.__version__,
+        'texts': len(texts),
+        'affix_table_strings': len(affix_table),
+        'results': results,
+    }
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(output, f, indent=2)
+
+
+def read_texts(texts_path: Optional[Path], max_texts: int) -> List[str]:
+    if texts_path is None:
+        return [s.text for s in read_sample()][:max_texts]
+
+    texts = []
+    for doc in srsly.read_jsonl(texts_path):
+        texts.append(doc['text'])
+        if len(texts) >= max_texts:
+            break
+    return texts
+
+
+def run(tokenizer, texts):
+    """Tokenize texts once and return (number of tokens, seconds)."""
+    num_tokens = 0
+    start = time.perf_counter()
+    for text in texts:
+        num_tokens += len(tokenizer(text))
+    return (num_tokens, time.perf_counter() - start)
+
+
+def summarize(timings) -> Dict[str, float]:
+    num_tokens = sum(n for n, _ in timings)
+    seconds = sum(s for _, s in timings)
+    return {
+        'tokens': num_tokens,
+        'seconds': seconds,
+        'tokens_per_second': num_tokens / seconds,
+    }
+
+
+if __name__ == '__main__':
+    typer.run(main)
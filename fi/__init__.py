@@ -1,3 +1,3 @@
-from .fi import FinnishExtended, FinnishExDefaults, VoikkoLemmatizer
+from .fi import FinnishExtended, FinnishExDefaults, NounChunker, VoikkoLemmatizer
 
-__all__ = ['FinnishExtended', 'FinnishExDefaults', 'VoikkoLemmatizer']
+__all__ = ['FinnishExtended', 'FinnishExDefaults', 'NounChunker', 'VoikkoLemmatizer']
@@ -1,26 +1,56 @@
+import bisect
+import copyreg
+import hashlib
+import mmap
+import os
 import re
-import libvoikko
+import struct
+import sys
+import threading
+import time
+import warnings
+import weakref
+import numpy as np
 import srsly
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import groupby, zip_longest
 from pathlib import Path
-from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, Iterable, Iterator, List, NamedTuple
+from typing import Optional, Pattern, Sequence, Tuple, Union
 from spacy import util
+from spacy.attrs import DEP, HEAD, LEMMA, MORPH, ORTH, POS
 from spacy.errors import Errors
 from spacy.lang.fi import Finnish, FinnishDefaults
 from spacy.language import Language
 from spacy.lookups import Lookups, load_lookups
+from spacy.morphology import Morphology
+from spacy.parts_of_speech import IDS as POS_IDS
+from spacy.pipeline.edit_tree_lemmatizer import DEFAULT_EDIT_TREE_LEMMATIZER_MODEL
+from spacy.pipeline.edit_tree_lemmatizer import EditTreeLemmatizer
+from spacy.pipeline.lemmatizer import lemmatizer_score
 from spacy.pipeline.pipe import Pipe
 from spacy.scorer import Scorer
+from spacy.strings import StringStore, hash_string
 from spacy.symbols import ADJ, ADP, ADV, AUX, CCONJ, INTJ, NOUN, NUM, PROPN
 from spacy.symbols import PRON, PUNCT, SCONJ, SPACE, SYM, VERB, X
 from spacy.symbols import conj, obj
-from spacy.tokens import Doc, Span, Token
+from spacy.tokenizer import Tokenizer
+from spacy.tokens import Doc, DocBin, Span, Token
 from spacy.training import Example, validate_examples
-from spacy.util import SimpleFrozenList
+from spacy.util import SimpleFrozenList, load_config_from_str
 from spacy.vocab import Vocab
+from thinc.api import Model
 from spacy.lang.char_classes import LIST_PUNCT, LIST_ELLIPSES, LIST_QUOTES, LIST_ICONS
 from spacy.lang.char_classes import LIST_HYPHENS, LIST_CURRENCY, CURRENCY, UNITS
 from spacy.lang.char_classes import ALPHA, ALPHA_LOWER, ALPHA_UPPER
 
+if TYPE_CHECKING:
+    # libvoikko is imported when the first Voikko handle is opened
+    import libvoikko
+
 LIST_QUOTES = [x for x in LIST_QUOTES if x not in ['', ',']]
 LIST_QUOTES = LIST_QUOTES + ["‹", "›"]
 CONCAT_QUOTES = ''.join(LIST_QUOTES)
@@ -81,15 +111,579 @@ _suffixes = (
 )
 
 
+class VoikkoAnalysis(NamedTuple):
+    """A compact representation of a Voikko analysis.
+
+    libvoikko returns each analysis as a dict. This keeps only the
+    attributes that the lemmatizer needs in a tuple. The values of the
+    enumeration-like attributes (such as word_class and sijamuoto) are
+    interned. The attribute names correspond to the Voikko keys listed
+    in voikko_keys.
+    """
+    baseform: Optional[str] = None
+    word_class: Optional[str] = None
+    sijamuoto: Optional[str] = None
+    number: Optional[str] = None
+    mood: Optional[str] = None
+    participle: Optional[str] = None
+    possessive: Optional[str] = None
+    focus: Optional[str] = None
+    kysymysliite: Optional[str] = None
+    structure: Optional[str] = None
+    wordbases: Optional[str] = None
+    fstoutput: Optional[str] = None
+
+    voikko_keys = (
+        "BASEFORM", "CLASS", "SIJAMUOTO", "NUMBER", "MOOD", "PARTICIPLE",
+        "POSSESSIVE", "FOCUS", "KYSYMYSLIITE", "STRUCTURE", "WORDBASES",
+        "FSTOUTPUT",
+    )
+    interned = (
+        False, True, True, True, True, True,
+        True, True, True, False, False,
+        False,
+    )
+
+    @classmethod
+    def from_voikko(cls, analysis: dict) -> "VoikkoAnalysis":
+        """Convert an analysis dict returned by libvoikko."""
+        return cls.from_fields([analysis.get(key) for key in cls.voikko_keys])
+
+    @classmethod
+    def from_fields(cls, fields: Sequence[Optional[str]]) -> "VoikkoAnalysis":
+        return cls._make(
+            sys.intern(x) if intern and x is not None else x
+            for x, intern in zip(fields, cls.interned)
+        )
+
+
+EMPTY_ANALYSIS = VoikkoAnalysis()
+
+
+# Parsing of the STRUCTURE, WORDBASES and FSTOUTPUT strings of Voikko
+# analyses. The parsed forms are memoized, because the lemma rules
+# inspect the same analyses over and over again.
+
+compound_re = re.compile(r"\+(\w+)(?:\(\+?[\w=]+\))?")
+wordbase_re = re.compile(r"\+([^+]+)")
+wordbase_parentheses_re = re.compile(r"(.+)\((.+)\)")
+minen_re = re.compile(r"\b(\w+)\[Tn4\]mi")
+ny_re = re.compile(r"\[X\]\[\w+\]\[Ny\](\w+)")
+
+
+class WordBase(NamedTuple):
+    """A "+"-prefixed part of WORDBASES, e.g. "+kirjoittaa(kirjoitta)".
+
+    form is the part before the parentheses, or the whole part if there
+    are no parentheses. base is the part in the parentheses and
+    base_size the number of "="-separated components in it.
+    """
+    form: str
+    base: Optional[str] = None
+    base_size: int = 0
+
+
+class AnalysisStructure(NamedTuple):
+    """Parsed STRUCTURE, WORDBASES and FSTOUTPUT of a Voikko analysis.
+
+    num_bases: The number of "=" (word bases) in STRUCTURE.
+    wordbases: The parts of WORDBASES.
+    compound_parts: The compound word parts listed in WORDBASES.
+    ny_baseform: The base form after the [Ny] tag in FSTOUTPUT, if any.
+    minen_stem: The stem of a MINEN-infinitive in FSTOUTPUT, if any.
+    """
+    num_bases: int
+    wordbases: Tuple[WordBase, ...]
+    compound_parts: Tuple[str, ...]
+    ny_baseform: Optional[str]
+    minen_stem: Optional[str]
+
+    @property
+    def is_compound(self) -> bool:
+        return self.num_bases > 1
+
+
+@lru_cache(maxsize=65536)
+def parse_analysis_structure(
+    structure: Optional[str], wordbases: Optional[str], fstoutput: Optional[str]
+) -> AnalysisStructure:
+    wordbases = wordbases or ""
+    fstoutput = fstoutput or ""
+
+    parsed_wordbases = []
+    for match in wordbase_re.finditer(wordbases):
+        full_form = match.group(1)
+        parentheses_match = wordbase_parentheses_re.search(full_form)
+        if parentheses_match:
+            base = parentheses_match.group(2)
+            parsed_wordbases.append(
+                WordBase(parentheses_match.group(1), base, base.count("=") + 1)
+            )
+        else:
+            parsed_wordbases.append(WordBase(full_form))
+
+    ny_match = ny_re.search(fstoutput)
+    minen_match = minen_re.search(fstoutput)
+
+    return AnalysisStructure(
+        num_bases=(structure or "").count("="),
+        wordbases=tuple(parsed_wordbases),
+        compound_parts=tuple(compound_re.findall(wordbases)),
+        ny_baseform=ny_match.group(1) if ny_match else None,
+        minen_stem=minen_match.group(1) if minen_match else None,
+    )
+
+
+def analysis_structure(analysis: VoikkoAnalysis) -> AnalysisStructure:
+    return parse_analysis_structure(analysis.structure, analysis.wordbases, analysis.fstoutput)
+
+
+class TokenAnalysis(NamedTuple):
+    """The parts of the disambiguated Voikko analysis of a token that
+    are exposed as token._.voikko_analysis.
+
+    compound_parts lists the parts of a compound word, e.g. ("koti",
+    "tehtävä") for "kotitehtäviä".
+    """
+    baseform: Optional[str]
+    word_class: Optional[str]
+    sijamuoto: Optional[str]
+    number: Optional[str]
+    possessive: Optional[str]
+    compound_parts: Tuple[str, ...]
+
+    @classmethod
+    def from_analysis(cls, analysis: VoikkoAnalysis) -> Optional["TokenAnalysis"]:
+        if analysis.word_class is None and analysis.baseform is None:
+            return None
+
+        return cls(
+            analysis.baseform,
+            analysis.word_class,
+            analysis.sijamuoto,
+            analysis.number,
+            analysis.possessive,
+            analysis_structure(analysis).compound_parts,
+        )
+
+
+def get_token_analysis(token: Token) -> Optional[TokenAnalysis]:
+    """Getter of the token._.voikko_analysis extension.
+
+    The analyses are stored as a list in doc._.voikko_analyses so that
+    they are serialized in the user data of a DocBin. The records are
+    tuples or, after a msgpack round trip, lists.
+    """
+    analyses = token.doc._.voikko_analyses
+    if analyses is None:
+        return None
+
+    record = analyses[token.i]
+    if record is None:
+        return None
+    return TokenAnalysis(*record[:5], tuple(record[5]))
+
+
+def register_analysis_extensions() -> None:
+    if not Doc.has_extension("voikko_analyses"):
+        Doc.set_extension("voikko_analyses", default=None)
+    if not Token.has_extension("voikko_analysis"):
+        Token.set_extension("voikko_analysis", getter=get_token_analysis)
+
+
+class WordToken(NamedTuple):
+    """The token attributes that are needed to lemmatize an isolated
+    word. Used by VoikkoLemmatizer.lemmatize_many() instead of a Token.
+    """
+    orth_: str
+    orth: int
+    lower: int
+    pos: int
+
+
+class VoikkoPool:
+    """A pool of Voikko handles shared by all lemmatizers in a process.
+
+    The handles are opened lazily on first use. A Voikko handle must not
+    be used by more than one thread at a time, so each thread borrows a
+    handle from the pool. ctypes releases the GIL during the native
+    libvoikko calls, which lets threads analyze words concurrently. At
+    most max_handles handles are opened.
+
+    Use get_voikko_pool() to get the shared pool.
+    """
+
+    def __init__(self, language: str = "fi", max_handles: Optional[int] = None) -> None:
+        self.language = language
+        self.max_handles = max_handles or os.cpu_count() or 1
+        self.num_handles = 0
+        self._idle = []
+        self._available = threading.Condition()
+
+    @contextmanager
+    def handle(self) -> Iterator["libvoikko.Voikko"]:
+        """Borrow a Voikko handle for the duration of the with block."""
+        voikko = self._acquire()
+        try:
+            yield voikko
+        finally:
+            with self._available:
+                self._idle.append(voikko)
+                self._available.notify()
+
+    def analyze(self, word: str) -> List[dict]:
+        with self.handle() as voikko:
+            return voikko.analyze(word)
+
+    def _acquire(self) -> "libvoikko.Voikko":
+        with self._available:
+            while not self._idle and self.num_handles >= self.max_handles:
+                self._available.wait()
+
+            if self._idle:
+                return self._idle.pop()
+
+            self.num_handles += 1
+
+        # Opening the dictionary is slow. Don't hold the lock meanwhile.
+        try:
+            import libvoikko
+
+            return libvoikko.Voikko(self.language)
+        except Exception:
+            with self._available:
+                self.num_handles -= 1
+                self._available.notify()
+            raise
+
+
+_voikko_pools: Dict[str, VoikkoPool] = {}
+_voikko_pools_lock = threading.Lock()
+
+
+def get_voikko_pool(language: str = "fi") -> VoikkoPool:
+    """Return the process-wide VoikkoPool for language."""
+    with _voikko_pools_lock:
+        pool = _voikko_pools.get(language)
+        if pool is None:
+            pool = VoikkoPool(language)
+            _voikko_pools[language] = pool
+        return pool
+
+
+def _reset_voikko_pools() -> None:
+    # Handles and locks inherited from the parent process must not be
+    # used in a forked child.
+    global _voikko_pools_lock
+    _voikko_pools.clear()
+    _voikko_pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_voikko_pools)
+
+
+class BoundedCache:
+    """A size-bounded cache for Voikko analyses and lemmas.
+
+    When the cache is full, the least recently used ("lru") or the
+    oldest inserted ("fifo") entry is evicted. A maxsize of 0 disables
+    the cache.
+    """
+    policies = ("lru", "fifo")
+
+    def __init__(self, maxsize: int = 10000, policy: str = "lru") -> None:
+        if policy not in self.policies:
+            raise ValueError(
+                f"Unknown cache eviction policy '{policy}'. "
+                f"Expected one of: {', '.join(self.policies)}"
+            )
+        if maxsize < 0:
+            raise ValueError(f"Cache size must be non-negative, got {maxsize}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __reduce__(self):
+        # Only the settings are pickled. The unpickled cache is empty.
+        return (self.__class__, (self.maxsize, self.policy))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            if self.policy == "lru":
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries. The counters are not affected."""
+        with self._lock:
+            self._data.clear()
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+class LemmatizerStats:
+    """Counters and timers collected by VoikkoLemmatizer when
+    collect_stats is enabled.
+
+    tokens counts the lemmatized tokens by the source of the lemma.
+    disambiguation counts the words by the rule that was used to choose
+    between several Voikko analyses.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.tokens = Counter()
+        self.disambiguation = Counter()
+        self.analysis_store_hits = 0
+        self.voikko_calls = 0
+        self.voikko_analyses = 0
+        self.voikko_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "tokens": dict(self.tokens),
+            "disambiguation": dict(self.disambiguation),
+            "analysis_store_hits": self.analysis_store_hits,
+            "voikko_calls": self.voikko_calls,
+            "analyses_per_voikko_call": (
+                self.voikko_analyses / self.voikko_calls if self.voikko_calls else 0.0
+            ),
+            "voikko_seconds": self.voikko_seconds,
+            "python_seconds": max(self.total_seconds - self.voikko_seconds, 0.0),
+        }
+
+
+class AnalysisStore:
+    """A read-only table of precomputed Voikko analyses.
+
+    The binary format consists of a header, a sorted array of 64-bit word
+    hashes, an array of offsets and a string pool of msgpack-encoded
+    (word, analyses) records. Each analysis is stored as a list of
+    VoikkoAnalysis fields. A store loaded from disk is memory-mapped,
+    so that all processes that load the same model share the pages.
+    """
+    magic = b"SPFIANA2"
+    header_format = "<8sIQ"  # magic, number of entries, pool size in bytes
+
+    def __init__(self, data: Union[bytes, mmap.mmap], path: Optional[Path] = None) -> None:
+        header_size = struct.calcsize(self.header_format)
+        magic, n, pool_size = struct.unpack_from(self.header_format, data)
+        if magic != self.magic:
+            raise ValueError("Not a valid analysis store file")
+
+        self._data = data
+        self._path = path
+        self._hashes = np.frombuffer(data, dtype="<u8", count=n, offset=header_size)
+        self._offsets = np.frombuffer(
+            data, dtype="<u8", count=n + 1, offset=header_size + 8 * n
+        )
+        pool_start = header_size + 8 * (2 * n + 1)
+        self._pool = memoryview(data)[pool_start:pool_start + pool_size]
+
+    @classmethod
+    def build(
+        cls, analyses: Iterable[Tuple[str, Iterable[Union[dict, VoikkoAnalysis]]]]
+    ) -> "AnalysisStore":
+        """Create a store from (word, Voikko analyses) pairs.
+
+        The analyses can be either dicts returned by libvoikko or
+        VoikkoAnalysis objects.
+        """
+        records = sorted(
+            (hash_string(word), srsly.msgpack_dumps([word, [
+                list(a if isinstance(a, VoikkoAnalysis) else VoikkoAnalysis.from_voikko(a))
+                for a in word_analyses
+            ]]))
+            for word, word_analyses in analyses
+        )
+        hashes = np.array([h for h, _ in records], dtype="<u8")
+        offsets = np.zeros(len(records) + 1, dtype="<u8")
+        offsets[1:] = np.cumsum([len(r) for _, r in records])
+        pool = b"".join(r for _, r in records)
+        header = struct.pack(cls.header_format, cls.magic, len(records), len(pool))
+        return cls(header + hashes.tobytes() + offsets.tobytes() + pool)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __reduce__(self):
+        # A memory-mapped store is re-opened from the same file when
+        # unpickled instead of copying the data.
+        if self._path is not None:
+            return (self.from_disk, (self._path,))
+        else:
+            return (self.__class__, (self.to_bytes(),))
+
+    def get(self, word: str) -> Optional[Tuple[VoikkoAnalysis, ...]]:
+        """Return the analyses of word, or None if the word is not in the store."""
+        key = hash_string(word)
+        i = int(np.searchsorted(self._hashes, key))
+        while i < len(self._hashes) and self._hashes[i] == key:
+            stored_word, word_analyses = srsly.msgpack_loads(
+                self._pool[self._offsets[i]:self._offsets[i + 1]]
+            )
+            if stored_word == word:
+                return tuple(VoikkoAnalysis.from_fields(x) for x in word_analyses)
+            i += 1
+        return None
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._data)
+
+    @classmethod
+    def from_bytes(cls, bytes_data: bytes) -> "AnalysisStore":
+        return cls(bytes_data)
+
+    def to_disk(self, path: Union[str, Path]) -> None:
+        path = util.ensure_path(path)
+        # Write to a temporary file first, because we might be
+        # overwriting the file that is currently memory-mapped.
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(self._data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_disk(cls, path: Union[str, Path]) -> "AnalysisStore":
+        path = util.ensure_path(path).resolve()
+        with path.open("rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+
+class LemmaTable:
+    """A precompiled table of lemmas keyed by the surface form, the POS
+    tag and the dependency class (see VoikkoLemmatizer.dep_class).
+
+    The table is generated offline by running the Voikko-based
+    lemmatizer over a corpus. It lets the lemmatizer assign lemmas to
+    frequent words without Voikko. The dependency classes depend on the
+    disambiguation mode of the lemmatizer, and the table can only be used
+    by lemmatizers that have the same disambiguation mode.
+    """
+
+    def __init__(self, disambiguation: str = "dep") -> None:
+        self.disambiguation = disambiguation
+        self.orths: List[str] = []
+        self.pos: List[str] = []
+        self.dep_classes: List[int] = []
+        self.lemmas: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.lemmas)
+
+    def add(self, orth: str, pos: str, dep_class: int, lemma: str) -> None:
+        self.orths.append(orth)
+        self.pos.append(pos)
+        self.dep_classes.append(dep_class)
+        self.lemmas.append(lemma)
+
+    def index(self, strings: StringStore) -> Dict[Tuple[int, int, int], int]:
+        """Return the table as a dict from (orth ID, POS ID, dependency
+        class) to the lemma ID. The strings are added to strings.
+        """
+        return {
+            (
+                strings.add(orth, allow_transient=False),
+                strings.add(pos, allow_transient=False),
+                dep_class,
+            ): strings.add(lemma, allow_transient=False)
+            for orth, pos, dep_class, lemma in zip(
+                self.orths, self.pos, self.dep_classes, self.lemmas
+            )
+        }
+
+    def to_bytes(self) -> bytes:
+        return srsly.msgpack_dumps({
+            "disambiguation": self.disambiguation,
+            "orths": self.orths,
+            "pos": self.pos,
+            "dep_classes": np.array(self.dep_classes, dtype=np.uint8).tobytes(),
+            "lemmas": self.lemmas,
+        })
+
+    @classmethod
+    def from_bytes(cls, bytes_data: bytes) -> "LemmaTable":
+        data = srsly.msgpack_loads(bytes_data)
+        table = cls(data.get("disambiguation", "dep"))
+        table.orths = data["orths"]
+        table.pos = data["pos"]
+        table.dep_classes = np.frombuffer(data["dep_classes"], dtype=np.uint8).tolist()
+        table.lemmas = data["lemmas"]
+        return table
+
+    def to_disk(self, path: Union[str, Path]) -> None:
+        with util.ensure_path(path).open("wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def from_disk(cls, path: Union[str, Path]) -> "LemmaTable":
+        with util.ensure_path(path).open("rb") as f:
+            return cls.from_bytes(f.read())
+
+
+# Characters that don't occur in words that Voikko could analyze: URLs,
+# hashtags, mentions, base64 and markup
+DEFAULT_GUARD_PATTERN = r"[#@/\\=+_|<>{}\[\]~^*]"
+
+
 class VoikkoLemmatizer(Pipe):
     """Pipeline component that assigns lemmas to Docs.
 
-    Lemmatization is done by libvoikko.
+    Lemmatization is done by libvoikko. The Voikko handles are shared
+    with other lemmatizers in the process (see VoikkoPool) and opened on
+    first use. The Voikko analyses are cached in a size-bounded cache
+    (see BoundedCache) because the same surface forms occur again and
+    again in running text. Analyses of frequent words can also be
+    precomputed into an AnalysisStore. Finally, the lemmas themselves
+    are memoized by the surface form, the POS tag and the dependency
+    class.
     """
-    compound_re = re.compile(r"\+(\w+)(?:\(\+?[\w=]+\))?")
-    minen_re = re.compile(r"\b(\w+)\[Tn4\]mi")
-    ny_re = re.compile(r"\[X\]\[\w+\]\[Ny\](\w+)")
     roman_numeral_structure_re = re.compile(r"=j+|=q+")
+    number_re = re.compile(r"[0-9]+(?:,[0-9]+)?")
     voikko_classes_by_pos = {
         ADJ:   frozenset(["laatusana", "nimisana_laatusana"]),
         ADP:   frozenset(["nimisana", "seikkasana", "suhdesana"]),
@@ -114,43 +708,541 @@ class VoikkoLemmatizer(Pipe):
         "3": ["nsa", "nsä", "an", "en", "in" "on", "un", "yn", "än", "ön"],
     }
 
+    modes = ("voikko", "lookup")
+
+    # Batches with at least this many tokens are processed with vectorized
+    # NumPy operations
+    vectorize_min_tokens = 64
+
+    # The key of the recorded lemmatization inputs in Doc.user_data
+    lemma_inputs_key = "spacyfi.lemma_inputs"
+
+    # Dependency classes that affect the disambiguation of the analyses.
+    # Only NOUNs and PRONs are classified as subjects or objects.
+    DEP_OTHER = 0
+    DEP_SUBJECT = 1
+    DEP_OBJECT = 2
+
+    disambiguation_modes = ("dep", "morph")
+
+    # In the "morph" disambiguation mode, nominals are classified by the
+    # Case feature instead of the dependency relation. The class is
+    # CASE_CLASS_START + the index in ud_cases.
+    CASE_CLASS_START = 3
+    ud_cases = (
+        ("Nom", "nimento"),
+        ("Gen", "omanto"),
+        ("Par", "osanto"),
+        ("Acc", "kohdanto"),
+        ("Ess", "olento"),
+        ("Tra", "tulento"),
+        ("Ine", "sisaolento"),
+        ("Ela", "sisaeronto"),
+        ("Ill", "sisatulento"),
+        ("Ade", "ulkoolento"),
+        ("Abl", "ulkoeronto"),
+        ("All", "ulkotulento"),
+        ("Abe", "vajanto"),
+        ("Com", "seuranto"),
+        ("Ins", "keinonto"),
+    )
+    case_classified_pos = (NOUN, PROPN, PRON, ADJ)
+
     def __init__(
             self,
             vocab: Vocab,
             name: str = "lemmatizer",
             *,
             overwrite_lemma: bool = False,
+            analysis_cache_size: int = 10000,
+            analysis_cache_policy: str = "lru",
+            lemma_cache_size: int = 50000,
+            mode: str = "voikko",
+            collect_stats: bool = False,
+            store_analyses: bool = False,
+            incremental: bool = False,
+            disambiguation: str = "dep",
+            max_word_length: int = 80,
+            max_hyphen_parts: int = 5,
+            guard_pattern: Optional[str] = DEFAULT_GUARD_PATTERN,
     ) -> None:
+        """Initialize the lemmatizer.
+
+        vocab (Vocab): The shared vocabulary.
+        name (str): The component instance name.
+        overwrite_lemma (bool): Whether to overwrite existing lemmas.
+        analysis_cache_size (int): The maximum number of words whose
+            Voikko analyses are cached. 0 disables the cache.
+        analysis_cache_policy (str): The eviction policy of the analysis
+            and lemma caches, "lru" or "fifo".
+        lemma_cache_size (int): The maximum number of memoized lemmas.
+            0 disables the memoization.
+        mode (str): "voikko" analyzes the words that are not found in the
+            lemma table with Voikko. "lookup" uses only the lemma table
+            and the exceptions, and falls back to the (lowercased)
+            surface form.
+        collect_stats (bool): Whether to collect counters and timers
+            that are returned by stats().
+        store_analyses (bool): Whether to keep the disambiguated Voikko
+            analyses in doc._.voikko_analyses. They are available as
+            token._.voikko_analysis and are serialized in a DocBin with
+            store_user_data=True. Tokens whose lemma is found without
+            Voikko (in the lemma table or by the rules) have no
+            analysis. Ignored in the "lookup" mode.
+        incremental (bool): Whether to record the inputs (the word, the
+            POS tag and the dependency class) of each lemma in the doc's
+            user data. When the doc is processed again, the tokens whose
+            inputs have changed are lemmatized again even if they
+            already have a lemma.
+        disambiguation (str): The token attributes that are used to
+            choose between ambiguous Voikko analyses. "dep" uses the
+            subject and object relations and requires a parser. "morph"
+            uses the Case feature assigned by a morphologizer, so the
+            lemmatizer can be run without a parser.
+        max_word_length (int): Words (or the last parts of hyphenated
+            words) longer than this are not analyzed. 0 disables the
+            limit.
+        max_hyphen_parts (int): Words with more hyphen-separated parts
+            than this are not analyzed. 0 disables the limit.
+        guard_pattern (Optional[str]): A regular expression. Words that
+            contain a match are not analyzed. None disables the guard.
+
+        Words that are not analyzed because of max_word_length,
+        max_hyphen_parts or guard_pattern get the same lemma as words
+        unknown to Voikko: the surface form, lowercased unless the word
+        is a proper noun, an interjection, a symbol or X. They are
+        counted as "guarded" in stats().
+        """
         super().__init__()
 
+        if mode not in self.modes:
+            raise ValueError(f"Invalid lemmatizer mode: {mode!r}. "
+                             f"Expected one of {self.modes}")
+        if disambiguation not in self.disambiguation_modes:
+            raise ValueError(f"Invalid disambiguation: {disambiguation!r}. "
+                             f"Expected one of {self.disambiguation_modes}")
+
         self.name = name
         self.vocab = vocab
-        self.voikko = libvoikko.Voikko("fi")
         self.lookups = Lookups()
         self.overwrite_lemma = overwrite_lemma
+        self.mode = mode
+        self.collect_stats = collect_stats
+        self.store_analyses = store_analyses
+        self.incremental = incremental
+        self.disambiguation = disambiguation
+        self.max_word_length = max_word_length
+        self.max_hyphen_parts = max_hyphen_parts
+        self.guard_re = re.compile(guard_pattern) if guard_pattern is not None else None
+        self._case_classes = {}
+        if store_analyses:
+            register_analysis_extensions()
+        self.lemmatizer_stats = LemmatizerStats()
+        self.analysis_cache = BoundedCache(analysis_cache_size, analysis_cache_policy)
+        self.analysis_store = None
+        self.lemma_cache = BoundedCache(lemma_cache_size, analysis_cache_policy)
+        self.lemma_table = None
+        self.exc_index = {}
+        self.table_index = {}
         self.nsubj_labels = [vocab.strings.add(x) for x in ["nsubj", "nsubj:cop"]]
 
+    def __reduce__(self):
+        # Pipe's Cython-generated __reduce__ would skip the name, which is
+        # a Cython attribute
+        state = self.__dict__.copy()
+        state["name"] = self.name
+        return (copyreg.__newobj__, (type(self),), state)
+
+    def __setstate__(self, state):
+        state = state.copy()
+        self.name = state.pop("name")
+        self.__dict__.update(state)
+        if self.store_analyses:
+            register_analysis_extensions()
+
+    @property
+    def voikko_pool(self) -> VoikkoPool:
+        return get_voikko_pool("fi")
+
     def __call__(self, doc: Doc) -> Doc:
         error_handler = self.get_error_handler()
         try:
-            for token in doc:
-                if token.pos in (PUNCT, SPACE):
-                    if self.overwrite_lemma or token.lemma == 0:
-                        token.lemma = token.orth
-                else:
-                    if self.overwrite_lemma or token.lemma == 0:
-                        analysis = self._analyze(token)
-                        token.lemma_ = self.lemmatize(token, analysis)
+            self.set_lemmas([doc])
             return doc
         except Exception as e:
             error_handler(self.name, self, [doc], e)
 
+    def pipe(self, stream: Iterable[Doc], *, batch_size: int = 128) -> Iterator[Doc]:
+        """Apply the lemmatizer to a stream of documents.
+
+        The documents are processed in batches. Each distinct word in a
+        batch is lemmatized only once.
+
+        stream (Iterable[Doc]): A stream of documents.
+        batch_size (int): The number of documents to buffer.
+        YIELDS (Doc): Processed documents in order.
+        """
+        error_handler = self.get_error_handler()
+        for docs in util.minibatch(stream, size=batch_size):
+            try:
+                self.set_lemmas(docs)
+                yield from docs
+            except Exception as e:
+                error_handler(self.name, self, docs, e)
+
+    def lemmatize_many(
+            self,
+            words: Iterable[str],
+            pos_tags: Iterable[str],
+            *,
+            batch_size: int = 10000,
+    ) -> Iterator[str]:
+        """Lemmatize isolated words without creating Docs.
+
+        The same rules, lemma table and caches are used as when the
+        lemmatizer is run in a pipeline. The words have no context, so
+        they are lemmatized like tokens that have no dependency relation
+        or Case feature.
+
+        words (Iterable[str]): The words to lemmatize.
+        pos_tags (Iterable[str]): The universal POS tag of each word.
+        batch_size (int): The number of words to read at a time. Each
+            distinct (word, POS tag) pair in a batch is lemmatized once.
+        YIELDS (str): The lemmas in the order of the words.
+        """
+        pairs = zip_longest(words, pos_tags)
+        for batch in util.minibatch(pairs, size=batch_size):
+            if self.collect_stats:
+                start = time.perf_counter()
+                lemmas = self._lemmatize_words(batch)
+                self.lemmatizer_stats.total_seconds += time.perf_counter() - start
+            else:
+                lemmas = self._lemmatize_words(batch)
+            yield from lemmas
+
+    def _lemmatize_words(self, pairs):
+        stats = self.lemmatizer_stats if self.collect_stats else None
+        strings = self.vocab.strings
+        memoize = not self.vocab.in_memory_zone
+        results = {}
+        lemmas = []
+        for pair in pairs:
+            result = results.get(pair)
+            if result is None:
+                word, pos_tag = pair
+                if word is None or pos_tag is None:
+                    raise ValueError("words and pos_tags must have the same length")
+                pos = POS_IDS.get(pos_tag)
+                if pos is None:
+                    raise ValueError(f"Invalid POS tag: {pos_tag!r}")
+
+                if pos in (PUNCT, SPACE):
+                    result = (word, "punct")
+                else:
+                    token = WordToken(word, hash_string(word), hash_string(word.lower()), pos)
+                    key = (token.orth, pos, self.DEP_OTHER)
+                    lemma, source, _, _ = self._lemma_for_key(key, [[token]], [0], 0, memoize)
+                    if lemma == token.orth:
+                        lemma = word
+                    elif lemma == token.lower:
+                        lemma = word.lower()
+                    else:
+                        lemma = strings[lemma]
+                    if source == "rules" and (pos, token.lower) in self.exc_index:
+                        source = "exceptions"
+                    result = (lemma, source)
+                results[pair] = result
+
+            if stats is not None:
+                stats.tokens[result[1]] += 1
+            lemmas.append(result[0])
+        return lemmas
+
+    def set_lemmas(self, docs: Iterable[Doc]) -> None:
+        """Assign lemmas to the tokens of a batch of documents.
+
+        The tokens are grouped by the inputs that determine the lemma:
+        the surface form, the POS tag and the dependency class. Each
+        group is lemmatized once, and the resulting lemma ID is memoized
+        for later batches. The lemma table is consulted before Voikko.
+        """
+        if self.collect_stats:
+            start = time.perf_counter()
+            self._set_lemmas(docs)
+            self.lemmatizer_stats.total_seconds += time.perf_counter() - start
+        else:
+            self._set_lemmas(docs)
+
+    def _set_lemmas(self, docs):
+        stats = self.lemmatizer_stats if self.collect_stats else None
+        store_analyses = self.store_analyses and self.mode != "lookup"
+
+        # Read the token attributes of the whole batch into one array and
+        # select the tokens that need a lemma with array operations. The
+        # lemmas are written back with one from_array() call per doc.
+        docs = list(docs)
+        attrs = [ORTH, POS, DEP, HEAD, LEMMA, MORPH]
+        arrays = [doc.to_array(attrs) for doc in docs]
+        offsets = [0]
+        for doc in docs:
+            offsets.append(offsets[-1] + len(doc))
+        if offsets[-1] == 0:
+            return
+        array = np.concatenate(arrays) if len(arrays) > 1 else arrays[0]
+
+        vectorize = len(array) >= self.vectorize_min_tokens
+        if self.incremental:
+            vectorize = True
+            dep_classes = self._dep_classes(array)
+            inputs = np.stack([array[:, 0], array[:, 1], dep_classes], axis=1)
+            changed = self._changed_tokens(docs, offsets, inputs)
+            punct, indices, keys = self._select_tokens(array, dep_classes, changed)
+            if stats is not None and changed.any():
+                stats.tokens["changed"] += int(changed.sum())
+        elif vectorize:
+            punct, indices, keys = self._select_tokens(array)
+        else:
+            punct, indices, keys = self._select_tokens_unvectorized(array)
+        if stats is not None and len(punct) > 0:
+            stats.tokens["punct"] += len(punct)
+
+        # Group the tokens by the inputs that determine the lemma. The
+        # group of each selected token is stored in inverse.
+        group_ids = {}
+        unique_keys = []
+        first = []
+        inverse = []
+        for i, key in zip(indices, keys):
+            g = group_ids.get(key)
+            if g is None:
+                g = group_ids[key] = len(unique_keys)
+                unique_keys.append(key)
+                first.append(i)
+            inverse.append(g)
+        if stats is not None:
+            counts = np.bincount(inverse, minlength=len(unique_keys))
+
+        # Strings added inside a memory zone are freed at the end of the
+        # zone. The cached lemma IDs must stay valid, so new lemmas are
+        # memoized only outside of memory zones.
+        memoize = not self.vocab.in_memory_zone
+        group_lemmas = []
+        records = [None] * len(unique_keys)
+        for g, key in enumerate(unique_keys):
+            lemma, source, token, analysis = self._lemma_for_key(
+                key, docs, offsets, first[g], memoize)
+
+            if stats is not None:
+                if source == "rules" and (key[1], token.lower) in self.exc_index:
+                    source = "exceptions"
+                stats.tokens[source] += int(counts[g])
+
+            if store_analyses:
+                if analysis is None and source == "lemma_cache":
+                    # Analyze the token only if the memoized lemma came
+                    # from Voikko
+                    token = token or self._group_token(docs, offsets, first[g])
+                    if key not in self.table_index and \
+                            self._lemmatize_without_analysis(token) is None:
+                        analysis = self._analyze(token, key[2]) or EMPTY_ANALYSIS
+                if analysis is not None:
+                    records[g] = TokenAnalysis.from_analysis(analysis)
+
+            group_lemmas.append(lemma)
+
+        if vectorize:
+            lemmas = array[:, 4]
+            lemmas[punct] = array[punct, 0]
+            lemmas[indices] = np.array(group_lemmas, dtype=np.uint64)[inverse]
+        else:
+            values = array[:, 4].tolist()
+            orths = array[:, 0].tolist()
+            for i in punct:
+                values[i] = orths[i]
+            for i, g in zip(indices, inverse):
+                values[i] = group_lemmas[g]
+            lemmas = np.array(values, dtype=np.uint64)
+        for doc, start, end in zip(docs, offsets[:-1], offsets[1:]):
+            doc.from_array([LEMMA], lemmas[start:end])
+
+        if self.incremental:
+            for doc, start, end in zip(docs, offsets[:-1], offsets[1:]):
+                doc.user_data[self.lemma_inputs_key] = inputs[start:end].copy()
+
+        if store_analyses:
+            # Tokens that were not lemmatized keep their earlier analyses
+            token_records = []
+            for doc in docs:
+                previous = doc._.voikko_analyses
+                if previous is not None and len(previous) == len(doc):
+                    token_records.extend(previous)
+                else:
+                    token_records.extend([None] * len(doc))
+            for i, g in zip(indices, inverse):
+                token_records[i] = records[g]
+            for doc, start, end in zip(docs, offsets[:-1], offsets[1:]):
+                doc._.voikko_analyses = token_records[start:end]
+
+    def _lemma_for_key(self, key, docs, offsets, i, memoize):
+        """Find the lemma ID for an (orth, POS, dependency class) key.
+
+        The memoized lemmas and the lemma table are consulted before the
+        rules and Voikko. The token at index i of the concatenated docs
+        (see _group_token) is looked up only if the key is not memoized.
+        The docs can also be lists of WordTokens.
+
+        Returns the lemma ID, the source of the lemma, and the token and
+        its Voikko analysis if they were needed (or else None).
+        """
+        analysis = None
+        token = None
+        lemma = self.lemma_cache.get(key)
+        source = "lemma_cache"
+        if lemma is None:
+            token = self._group_token(docs, offsets, i)
+            lemma = self.table_index.get(key)
+            source = "lemma_table"
+            if lemma is None:
+                lemma = self._lemmatize_without_analysis(token)
+                source = "rules"
+            if lemma is None:
+                if self.mode == "lookup":
+                    lemma = self._fallback_lemma(token)
+                    source = "fallback"
+                else:
+                    analysis = self._analyze(token, key[2])
+                    source = "voikko"
+                    if analysis is None:
+                        analysis = EMPTY_ANALYSIS
+                        source = "guarded"
+                    lemma = self.vocab.strings.add(self.lemmatize(token, analysis))
+            # Guarded words are rarely repeated. Don't let them evict
+            # the memoized lemmas of common words.
+            if memoize and source != "guarded":
+                self.lemma_cache.put(key, lemma)
+        return lemma, source, token, analysis
+
+    def _select_tokens(self, array, dep_classes=None, changed=None):
+        """Select the tokens to lemmatize from an array of (ORTH, POS,
+        DEP, HEAD, LEMMA, MORPH) rows.
+
+        Returns the indices of punctuation tokens, whose lemma is the
+        surface form, and the indices and the (orth, POS, dependency
+        class) keys of the other tokens that need a lemma. Tokens marked
+        in the optional changed mask are selected even if they already
+        have a lemma.
+        """
+        orths, pos, lemmas = array[:, 0], array[:, 1], array[:, 4]
+        if self.overwrite_lemma:
+            selected = np.ones(len(array), dtype=bool)
+        else:
+            selected = lemmas == 0
+        if changed is not None:
+            selected |= changed
+        is_punct = (pos == PUNCT) | (pos == SPACE)
+        indices = np.flatnonzero(selected & ~is_punct)
+        if dep_classes is None:
+            dep_classes = self._dep_classes(array)
+
+        keys = zip(
+            orths[indices].tolist(), pos[indices].tolist(), dep_classes[indices].tolist()
+        )
+        return np.flatnonzero(selected & is_punct).tolist(), indices.tolist(), keys
+
+    def _dep_classes(self, array):
+        """Vectorized dep_class() for an array of (ORTH, POS, DEP, HEAD,
+        LEMMA, MORPH) rows.
+        """
+        if self.disambiguation == "morph":
+            pos, morphs = array[:, 1], array[:, 5]
+            dep_classes = np.full(len(array), self.DEP_OTHER, dtype=np.uint64)
+            nominal = np.isin(pos, self.case_classified_pos)
+            unique_morphs, inverse = np.unique(morphs[nominal], return_inverse=True)
+            classes = [self._case_class(m) for m in unique_morphs.tolist()]
+            dep_classes[nominal] = np.array(classes, dtype=np.uint64)[inverse]
+            return dep_classes
+
+        pos, deps = array[:, 1], array[:, 2]
+        heads = np.arange(len(array)) + array[:, 3].view(np.int64)
+        deps = np.where(deps == conj, deps[heads], deps)
+        nominal = (pos == NOUN) | (pos == PRON)
+        subject = np.zeros(len(array), dtype=bool)
+        for label in self.nsubj_labels:
+            subject |= deps == label
+        dep_classes = np.full(len(array), self.DEP_OTHER, dtype=np.uint64)
+        dep_classes[nominal & subject] = self.DEP_SUBJECT
+        dep_classes[nominal & (deps == obj)] = self.DEP_OBJECT
+        return dep_classes
+
+    def _changed_tokens(self, docs, offsets, inputs):
+        """Compare the lemmatization inputs to the ones recorded on the
+        previous run in the incremental mode.
+
+        Returns a mask of the tokens whose inputs have changed. If a doc
+        has no record, none of its tokens are marked. If the number of
+        tokens has changed, all tokens are marked.
+        """
+        changed = np.zeros(len(inputs), dtype=bool)
+        for doc, start, end in zip(docs, offsets[:-1], offsets[1:]):
+            previous = doc.user_data.get(self.lemma_inputs_key)
+            if previous is None:
+                continue
+            elif len(previous) != end - start:
+                changed[start:end] = True
+            else:
+                changed[start:end] = (np.asarray(previous) != inputs[start:end]).any(axis=1)
+        return changed
+
+    def _select_tokens_unvectorized(self, array):
+        """Same as _select_tokens(), but loops over the rows. This is
+        faster on short batches where the overhead of the NumPy calls
+        dominates.
+        """
+        punct = []
+        indices = []
+        keys = []
+        rows = array.tolist()
+        by_case = self.disambiguation == "morph"
+        for i, (orth, pos, dep, head, lemma, morph) in enumerate(rows):
+            if lemma != 0 and not self.overwrite_lemma:
+                continue
+
+            if pos == PUNCT or pos == SPACE:
+                punct.append(i)
+                continue
+
+            dep_class = self.DEP_OTHER
+            if by_case:
+                if pos in self.case_classified_pos:
+                    dep_class = self._case_class(morph)
+            elif pos == NOUN or pos == PRON:
+                if dep == conj:
+                    # HEAD is a relative offset stored as uint64
+                    dep = rows[(i + head) & 0xFFFFFFFFFFFFFFFF][2]
+                if dep in self.nsubj_labels:
+                    dep_class = self.DEP_SUBJECT
+                elif dep == obj:
+                    dep_class = self.DEP_OBJECT
+
+            indices.append(i)
+            keys.append((orth, pos, dep_class))
+
+        return punct, indices, keys
+
+    @staticmethod
+    def _group_token(docs, offsets, i):
+        """Return the token at index i of the concatenated docs."""
+        doc_index = bisect.bisect_right(offsets, i) - 1
+        return docs[doc_index][i - offsets[doc_index]]
+
     def initialize(
         self,
         get_examples: Optional[Callable[[], Iterable[Example]]] = None,
         *,
         nlp: Optional[Language] = None,
         lookups: Optional[Lookups] = None,
+        analysis_store: Optional[AnalysisStore] = None,
+        lemma_table: Optional[LemmaTable] = None,
     ):
         """Initialize the lemmatizer and load in data.
         get_examples (Callable[[], Iterable[Example]]): Function that
@@ -158,12 +1250,24 @@ class VoikkoLemmatizer(Pipe):
         nlp (Language): The current nlp object the component is part of.
         lookups (Lookups): The lookups object containing the (optional) tables
             such as "lemma_exc". Defaults to None.
+        analysis_store (AnalysisStore): Precomputed Voikko analyses of
+            frequent words. Defaults to None.
+        lemma_table (LemmaTable): Precomputed lemmas of frequent words.
+            Required in the "lookup" mode to get useful lemmas. Defaults
+            to None.
         """
         if lookups is None:
             lookups = load_lookups(lang=self.vocab.lang, tables=["lemma_exc"])
         self.lookups = lookups
-
-    def lemmatize(self, token: Token, analysis: dict) -> str:
+        self.analysis_store = analysis_store
+        if lemma_table is not None and lemma_table.disambiguation != self.disambiguation:
+            raise ValueError(f"The lemma table was created in the "
+                             f"{lemma_table.disambiguation!r} disambiguation mode "
+                             f"but the lemmatizer uses {self.disambiguation!r}")
+        self.lemma_table = lemma_table
+        self._data_changed()
+
+    def lemmatize(self, token: Token, analysis: VoikkoAnalysis) -> str:
         cached_lower = None
         exc_table = self.lookups.get_table("lemma_exc", {}).get(token.pos)
         if exc_table is not None:
@@ -174,9 +1278,9 @@ class VoikkoLemmatizer(Pipe):
 
         # Some exceptions to Voikko's lemmatization algorithm to
         # better match UD lemmas
-        if token.pos in (AUX, VERB) and "PARTICIPLE" in analysis:
+        if token.pos in (AUX, VERB) and analysis.participle is not None:
             return self._participle_lemma(analysis)
-        elif token.pos == NOUN and analysis.get("MOOD") == "MINEN-infinitive":
+        elif token.pos == NOUN and analysis.mood == "MINEN-infinitive":
             return self._minen_noun_lemma(analysis)
         elif token.pos in (NOUN, NUM, PROPN) and ':' in token.orth_:
             # Lemma of an inflected abbreviation: BBC:n -> BCC, EU:ssa -> EU
@@ -186,23 +1290,119 @@ class VoikkoLemmatizer(Pipe):
             cached_lower = cached_lower or token.orth_.lower()
             return self._adv_lemma(analysis, cached_lower)
         elif token.pos == PROPN:
-            lemma = analysis.get("BASEFORM", token.orth_)
+            lemma = analysis.baseform if analysis.baseform is not None else token.orth_
             if lemma and lemma[0].islower() and token.orth_[0].isupper():
                 lemma = lemma[0].upper() + lemma[1:]
             return lemma
         elif token.pos == SYM:
             return token.orth_
-        elif "BASEFORM" not in analysis:
+        elif analysis.baseform is None:
             if token.pos in (PROPN, INTJ, SYM, X):
                 return token.orth_
             else:
                 return cached_lower or token.orth_.lower()
         else:
-            return analysis["BASEFORM"]
+            return analysis.baseform
+
+    def _data_changed(self):
+        # Index the exceptions by the integer IDs of the POS tag and the
+        # lowercased word so that they can be matched without creating
+        # strings
+        self.exc_index = {}
+        for pos, exceptions in self.lookups.get_table("lemma_exc", {}).items():
+            for word, lemma in exceptions.items():
+                if lemma:
+                    key = (pos, self.vocab.strings.add(word, allow_transient=False))
+                    self.exc_index[key] = self.vocab.strings.add(lemma, allow_transient=False)
+
+        if self.lemma_table is not None:
+            self.table_index = self.lemma_table.index(self.vocab.strings)
+        else:
+            self.table_index = {}
 
-    def _analyze(self, token):
+        self.lemma_cache.clear()
+
+    def _fallback_lemma(self, token):
+        """Return the lemma ID for a word that is not in the lemma table
+        in the lookup mode. Agrees with lemmatize() on words unknown to
+        Voikko.
+        """
+        if token.pos in (PROPN, INTJ, SYM, X):
+            return token.orth
+        else:
+            return token.lower
+
+    def _lemmatize_without_analysis(self, token):
+        """Return the lemma ID for tokens that don't need a Voikko analysis.
+
+        Returns None if the token must be analyzed. This must agree with
+        lemmatize().
+        """
+        pos = token.pos
+        exc = self.exc_index.get((pos, token.lower))
+        if exc is not None:
+            return exc
+        elif pos == SYM:
+            return token.orth
+
+        orth = token.orth_
+        if pos in (NOUN, NUM, PROPN) and ':' in orth:
+            # Lemma of an inflected abbreviation: BBC:n -> BCC, EU:ssa -> EU
+            return self.vocab.strings.add(orth[:orth.find(":")])
+        elif self.number_re.fullmatch(orth):
+            # Voikko's base form of a number is the number itself
+            return token.orth
+        else:
+            return None
+
+    def dep_class(self, token: Token) -> int:
+        """Classify the token by the dependency relations that affect the
+        disambiguation of the analyses. In the "morph" disambiguation
+        mode, the token is classified by the Case feature instead.
+        """
+        if self.disambiguation == "morph":
+            if token.pos in self.case_classified_pos:
+                return self._case_class(token.morph.key)
+            else:
+                return self.DEP_OTHER
+
+        if token.pos not in (NOUN, PRON):
+            return self.DEP_OTHER
+
+        dep = token.dep
+        if dep == conj:
+            dep = token.head.dep
+
+        if dep in self.nsubj_labels:
+            return self.DEP_SUBJECT
+        elif dep == obj:
+            return self.DEP_OBJECT
+        else:
+            return self.DEP_OTHER
+
+    def _case_class(self, morph: int) -> int:
+        case_class = self._case_classes.get(morph)
+        if case_class is None:
+            case_class = self.DEP_OTHER
+            if morph != 0:
+                feats = Morphology.feats_to_dict(self.vocab.strings[morph])
+                for i, (ud_case, _) in enumerate(self.ud_cases):
+                    if feats.get("Case") == ud_case:
+                        case_class = self.CASE_CLASS_START + i
+            self._case_classes[morph] = case_class
+        return case_class
+
+    def _analyze(self, token, dep_class):
+        """Return the disambiguated Voikko analysis of the token, or None
+        if the token trips one of the guards (see _is_guarded()).
+        """
         orth = token.orth_
+        if self._is_guarded(orth):
+            return None
+
         if '-' in orth and orth[-1] != '-':
+            if self.max_hyphen_parts and orth.count('-') >= self.max_hyphen_parts:
+                return None
             # Analyze only the head token on hyphenated compound
             # words.
             parts = [x for x in orth.rsplit('-', 1) if x]
@@ -211,48 +1411,83 @@ class VoikkoLemmatizer(Pipe):
         else:
             parts = [orth]
 
-        analyses = self.voikko.analyze(orth)
-        analysis = self._disambiguate_analyses(token, analyses)
-        if len(parts) > 1 and "BASEFORM" in analysis:
-            analysis["BASEFORM"] = parts[0] + "-" + analysis["BASEFORM"]
+        analyses = self._voikko_analyze(orth)
+        analysis = self._disambiguate_analyses(token, analyses, dep_class)
+        if len(parts) > 1 and analysis.baseform is not None:
+            analysis = analysis._replace(baseform=parts[0] + "-" + analysis.baseform)
         return analysis
 
-    def _disambiguate_analyses(self, token, analyses):
+    def _is_guarded(self, word):
+        """Whether the word is too long or contains characters that don't
+        occur in Finnish words. Such words are not passed to Voikko.
+        """
+        if self.max_word_length and len(word) > self.max_word_length:
+            return True
+        return self.guard_re is not None and self.guard_re.search(word) is not None
+
+    def _voikko_analyze(self, word):
+        analyses = self.analysis_cache.get(word)
+        if analyses is None:
+            if self.analysis_store is not None:
+                analyses = self.analysis_store.get(word)
+                if analyses is not None and self.collect_stats:
+                    self.lemmatizer_stats.analysis_store_hits += 1
+            if analyses is None:
+                if self.collect_stats:
+                    start = time.perf_counter()
+                    raw_analyses = self.voikko_pool.analyze(word)
+                    stats = self.lemmatizer_stats
+                    stats.voikko_seconds += time.perf_counter() - start
+                    stats.voikko_calls += 1
+                    stats.voikko_analyses += len(raw_analyses)
+                else:
+                    raw_analyses = self.voikko_pool.analyze(word)
+                analyses = tuple(VoikkoAnalysis.from_voikko(x) for x in raw_analyses)
+            self.analysis_cache.put(word, analyses)
+        return analyses
+
+    def _disambiguate_analyses(self, token, analyses, dep_class):
         matching_pos = [x for x in analyses if self._analysis_has_compatible_pos(token, x)]
         if matching_pos:
             analyses = matching_pos
 
         if len(analyses) > 1:
             # Disambiguate among multiple possible analyses
+            if self.collect_stats:
+                self._count_disambiguation(token, dep_class)
 
             if token.pos == NUM:
                 # For numbers like 1,5 prefer the analysis without
                 # SIJAMUOTO and NUMBER because UD doesn't have them,
                 # either.
-                analyses = [x for x in analyses if "SIJAMUOTO" not in x] or analyses
+                analyses = [x for x in analyses if x.sijamuoto is None] or analyses
 
                 # Prefer uppercase Roman numerals
-                if all(self.roman_numeral_structure_re.fullmatch(x.get("STRUCTURE", ""))
+                if all(self.roman_numeral_structure_re.fullmatch(x.structure or "")
                        for x in analyses):
-                    analyses = [x for x in analyses if "j" in x.get("STRUCTURE")]
+                    analyses = [x for x in analyses if "j" in x.structure]
 
-            elif token.pos in (NOUN, PRON) and \
-                 ((token.dep in self.nsubj_labels) or
-                  (token.dep == conj and token.head.dep in self.nsubj_labels)):
+            elif dep_class == self.DEP_SUBJECT:
                 # Subject is usually nominative, genetive or partitive
                 analyses = [
                     x for x in analyses
-                    if x.get("SIJAMUOTO") in ["nimento", "omanto", "osanto"]
+                    if x.sijamuoto in ("nimento", "omanto", "osanto")
                 ] or analyses
 
-            elif token.pos in (NOUN, PRON) and \
-                 (token.dep == obj or (token.dep == conj and token.head.dep == obj)):
+            elif dep_class == self.DEP_OBJECT:
                 # Object is usually partitive, accusative or genetive
                 analyses = [
                     x for x in analyses
-                    if x.get("SIJAMUOTO") in ("kohdanto", "omanto", "osanto")
+                    if x.sijamuoto in ("kohdanto", "omanto", "osanto")
                 ] or analyses
 
+            elif dep_class >= self.CASE_CLASS_START:
+                # Prefer the case assigned by the morphologizer
+                sijamuoto = self.ud_cases[dep_class - self.CASE_CLASS_START][1]
+                analyses = [x for x in analyses if x.sijamuoto == sijamuoto] or analyses
+                if token.pos == NOUN:
+                    analyses = sorted(analyses, key=self._is_compound_word)
+
             elif token.pos == NOUN:
                 # Prefer non-compound words.
                 # e.g. "asemassa" will be lemmatized as "asema", not "ase#massa"
@@ -261,74 +1496,81 @@ class VoikkoLemmatizer(Pipe):
         if analyses:
             return analyses[0]
         else:
-            return {}
+            return EMPTY_ANALYSIS
+
+    def _count_disambiguation(self, token, dep_class):
+        if token.pos == NUM:
+            rule = "num"
+        elif dep_class == self.DEP_SUBJECT:
+            rule = "subject"
+        elif dep_class == self.DEP_OBJECT:
+            rule = "object"
+        elif dep_class >= self.CASE_CLASS_START:
+            rule = "case"
+        elif token.pos == NOUN:
+            rule = "compound_sort"
+        else:
+            rule = "none"
+        self.lemmatizer_stats.disambiguation[rule] += 1
 
     def _analysis_has_compatible_pos(self, token, analysis):
-        if "CLASS" not in analysis:
+        vclass = analysis.word_class
+        if vclass is None:
             return False
 
         tpos = token.pos
-        vclass = analysis["CLASS"]
 
         return (
             vclass in self.voikko_classes_by_pos.get(tpos, [])
 
             or
 
-            (tpos == NOUN and vclass == "teonsana" and analysis.get("MOOD") == "MINEN-infinitive")
+            (tpos == NOUN and vclass == "teonsana" and analysis.mood == "MINEN-infinitive")
 
             or
 
             (tpos == VERB and (
-                (vclass == "teonsana" and analysis.get("MOOD") != "MINEN-infinitive") or
-                ("PARTICIPLE" in analysis and (
+                (vclass == "teonsana" and analysis.mood != "MINEN-infinitive") or
+                (analysis.participle is not None and (
                     # agent participle
-                    (vclass == "nimisana" and analysis["PARTICIPLE"] == "agent") or
+                    (vclass == "nimisana" and analysis.participle == "agent") or
                     # VA, NUT and TU participles
-                    (vclass == "laatusana" and analysis["PARTICIPLE"] in (
+                    (vclass == "laatusana" and analysis.participle in (
                         "past_active", "past_passive", "present_active", "present_passive"))))))
 
             or
 
             (tpos == ADV and
              vclass in ("laatusana", "lukusana") and
-             analysis.get("SIJAMUOTO") == "kerrontosti")
+             analysis.sijamuoto == "kerrontosti")
         )
 
     def _minen_noun_lemma(self, analysis):
-        fstoutput = analysis.get("FSTOUTPUT")
-        ny_match = self.ny_re.search(fstoutput)
-        if ny_match:
-            return ny_match.group(1)
+        parsed = analysis_structure(analysis)
+        if parsed.ny_baseform:
+            return parsed.ny_baseform
 
-        fst_match = self.minen_re.search(fstoutput)
-        if not fst_match:
+        stem = parsed.minen_stem
+        if not stem:
             return None
 
-        stem = fst_match.group(1)
-        compounds = self.compound_re.findall(analysis.get("WORDBASES"))
+        compounds = parsed.compound_parts
         if len(compounds) > 1:
             return "".join(compounds[:-1]) + stem + "minen"
         else:
             return stem + "minen"
 
     def _participle_lemma(self, analysis):
-        wordbases = analysis.get("WORDBASES")
-        num_bases = max(analysis.get("STRUCTURE", "").count("="), 1)
+        parsed = analysis_structure(analysis)
+        num_bases = max(parsed.num_bases, 1)
 
         i = 0
         forms = []
-        for base in re.finditer(r"\+([^+]+)", wordbases):
-            full_form = base.group(1)
-            parentheses_match = re.search(r"(.+)\((.+)\)", full_form)
-            if parentheses_match:
-                k = parentheses_match.group(2).count("=") + 1
-                if i < num_bases - k:
-                    form = parentheses_match.group(1)
-                else:
-                    form = parentheses_match.group(2)
+        for base in parsed.wordbases:
+            if base.base is not None and i >= num_bases - base.base_size:
+                form = base.base
             else:
-                form = full_form
+                form = base.form
 
             split = form.split("=")
             forms.extend(split)
@@ -340,16 +1582,16 @@ class VoikkoLemmatizer(Pipe):
         return ''.join(forms)
 
     def _adv_lemma(self, analysis, word):
-        if "KYSYMYSLIITE" in analysis:
+        if analysis.kysymysliite is not None:
             # "mukanaanko", "pidempäänkö"
             word = word[:-2]
 
-        focus = analysis.get("FOCUS")
+        focus = analysis.focus
         if focus:
             # "ennenkin", "myöskään"
             word = word[:-len(focus)]
 
-        possessive = analysis.get("POSSESSIVE")
+        possessive = analysis.possessive
         if possessive is not None and possessive != "3":
             # "kanssani", "vierestäni"
             word = self._remove_possessive_suffix(word, analysis)
@@ -361,27 +1603,45 @@ class VoikkoLemmatizer(Pipe):
 
         Example: "kanssamme" -> "kanssa"
         """
-        suffixes = self.possessive_suffixes.get(analysis.get("POSSESSIVE", ""), [])
+        suffixes = self.possessive_suffixes.get(analysis.possessive or "", [])
         suffix = next((s for s in suffixes if word.endswith(s)), None)
         if not suffix:
             return word
 
         word = word[:-len(suffix)]
-        if analysis.get("SIJAMUOTO") == "tulento" and word.endswith("e"):
+        if analysis.sijamuoto == "tulento" and word.endswith("e"):
             # onne+kse+mme -> onne+ksi
             word = word[:-1] + "i"
-        elif analysis.get("SIJAMUOTO") == "sisatulento":
+        elif analysis.sijamuoto == "sisatulento":
             # lapsee+ni -> lapseen
             word = word + "n"
-        elif suffix.startswith('n') and analysis.get("BASEFORM", "").endswith("n"):
+        elif suffix.startswith('n') and (analysis.baseform or "").endswith("n"):
             # mukaa+ni -> mukaan
             word = word + "n"
 
         return word
 
     def _is_compound_word(self, analysis):
-        structure = analysis.get('STRUCTURE', '')
-        return structure.count('=') > 1
+        return analysis_structure(analysis).is_compound
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the counters and timers collected since the last
+        reset_stats(), and the cache statistics.
+
+        The lemmatizer must be created with collect_stats=True (or the
+        collect_stats attribute set) for the counters to be updated. The
+        cache statistics are always available.
+        """
+        stats = self.lemmatizer_stats.to_dict()
+        stats["analysis_cache"] = self.analysis_cache.info()
+        stats["lemma_cache"] = self.lemma_cache.info()
+        return stats
+
+    def reset_stats(self) -> None:
+        """Reset the counters and timers returned by stats()."""
+        self.lemmatizer_stats.reset()
+        self.analysis_cache.reset_counters()
+        self.lemma_cache.reset_counters()
 
     def score(self, examples, **kwargs):
         validate_examples(examples, "VoikkoLemmatizer.score")
@@ -393,120 +1653,1663 @@ class VoikkoLemmatizer(Pipe):
         self, path: Union[str, Path], *, exclude: Iterable[str] = SimpleFrozenList()
     ):
         serialize = {"lookups": lambda p: self.lookups.to_disk(p)}
+        if self.analysis_store is not None:
+            serialize["analyses.bin"] = lambda p: self.analysis_store.to_disk(p)
+        if self.lemma_table is not None:
+            serialize["lemma_table.bin"] = lambda p: self.lemma_table.to_disk(p)
         util.to_disk(path, serialize, exclude)
 
     def from_disk(
         self, path: Union[str, Path], *, exclude: Iterable[str] = SimpleFrozenList()
     ) -> "VoikkoLemmatizer":
-        deserialize = {"lookups": lambda p: self.lookups.from_disk(p)}
+        deserialize = {
+            "lookups": lambda p: self.lookups.from_disk(p),
+            "analyses.bin": self._load_analysis_store,
+            "lemma_table.bin": self._load_lemma_table,
+        }
         util.from_disk(path, deserialize, exclude)
+        self._data_changed()
         return self
 
     def to_bytes(self, *, exclude: Iterable[str] = SimpleFrozenList()) -> bytes:
-        serialize = {"lookups": self.lookups.to_bytes}
+        serialize = {
+            "lookups": self.lookups.to_bytes,
+            "analyses": lambda: (
+                self.analysis_store.to_bytes() if self.analysis_store is not None else b""
+            ),
+            "lemma_table": lambda: (
+                self.lemma_table.to_bytes() if self.lemma_table is not None else b""
+            ),
+        }
         return util.to_bytes(serialize, exclude)
 
     def from_bytes(
         self, bytes_data: bytes, *, exclude: Iterable[str] = SimpleFrozenList()
     ) -> "VoikkoLemmatizer":
-        deserialize = {"lookups": lambda b: self.lookups.from_bytes(b)}
+        deserialize = {
+            "lookups": lambda b: self.lookups.from_bytes(b),
+            "analyses": lambda b: setattr(
+                self, "analysis_store", AnalysisStore.from_bytes(b) if b else None
+            ),
+            "lemma_table": lambda b: self._set_lemma_table(
+                LemmaTable.from_bytes(b) if b else None
+            ),
+        }
         util.from_bytes(bytes_data, deserialize, exclude)
+        self._data_changed()
         return self
 
+    def _load_analysis_store(self, path: Path) -> None:
+        self.analysis_store = AnalysisStore.from_disk(path) if path.exists() else None
+
+    def _load_lemma_table(self, path: Path) -> None:
+        self._set_lemma_table(LemmaTable.from_disk(path) if path.exists() else None)
+
+    def _set_lemma_table(self, lemma_table: Optional[LemmaTable]) -> None:
+        # A saved pipeline can be loaded with a different disambiguation
+        # mode (e.g. without the parser). The dependency classes of the
+        # table don't match then, so the table is left out.
+        if lemma_table is not None and lemma_table.disambiguation != self.disambiguation:
+            warnings.warn(f"Ignoring the lemma table of the "
+                          f"{lemma_table.disambiguation!r} disambiguation mode "
+                          f"because the lemmatizer uses {self.disambiguation!r}")
+            lemma_table = None
+        self.lemma_table = lemma_table
+
 
 @Finnish.factory(
     "voikko_lemmatizer",
     assigns=["token.lemma"],
-    requires=["token.dep", "token.pos"],
+    requires=["token.dep", "token.morph", "token.pos"],
     default_score_weights={"lemma_acc": 0.0},
 )
 def make_voikko_lemmatizer(
     nlp: Language,
     name: str,
-    overwrite_lemma: bool = False
+    overwrite_lemma: bool = False,
+    analysis_cache_size: int = 10000,
+    analysis_cache_policy: str = "lru",
+    lemma_cache_size: int = 50000,
+    mode: str = "voikko",
+    collect_stats: bool = False,
+    store_analyses: bool = False,
+    incremental: bool = False,
+    disambiguation: str = "dep",
+    max_word_length: int = 80,
+    max_hyphen_parts: int = 5,
+    guard_pattern: Optional[str] = DEFAULT_GUARD_PATTERN,
 ):
-    return VoikkoLemmatizer(nlp.vocab, name, overwrite_lemma=overwrite_lemma)
+    return VoikkoLemmatizer(
+        nlp.vocab,
+        name,
+        overwrite_lemma=overwrite_lemma,
+        analysis_cache_size=analysis_cache_size,
+        analysis_cache_policy=analysis_cache_policy,
+        lemma_cache_size=lemma_cache_size,
+        mode=mode,
+        collect_stats=collect_stats,
+        store_analyses=store_analyses,
+        incremental=incremental,
+        disambiguation=disambiguation,
+        max_word_length=max_word_length,
+        max_hyphen_parts=max_hyphen_parts,
+        guard_pattern=guard_pattern,
+    )
+
+
+class ConfidentEditTreeLemmatizer(EditTreeLemmatizer):
+    """Edit tree lemmatizer that leaves the hard cases to Voikko.
+
+    The lemma is left unset if the probability of the predicted edit
+    tree is below the threshold, if no predicted edit tree is applicable
+    or, optionally, if the word did not occur in the training data. A
+    fi.voikko_lemmatizer with overwrite_lemma = false later in the
+    pipeline lemmatizes only those tokens.
+    """
 
+    def __init__(
+            self,
+            vocab: Vocab,
+            model: Model,
+            name: str = "edit_tree_lemmatizer",
+            *,
+            min_tree_freq: int = 3,
+            overwrite: bool = False,
+            top_k: int = 1,
+            threshold: float = 0.9,
+            known_words_only: bool = False,
+            scorer: Optional[Callable] = lemmatizer_score,
+    ) -> None:
+        """Initialize the lemmatizer.
 
-def noun_chunks(doclike: Union[Doc, Span]) -> Iterator[Tuple[int, int, int]]:
-    """Detect base noun phrases from a dependency parse. Works on both Doc and Span."""
-    labels = [
-        "appos",
-        "nsubj",
-        "nsubj:cop",
-        "obj",
-        "obl",
-        "ROOT",
-    ]
-    extend_labels = [
-        "amod",
-        "compound",
-        "compound:nn",
-        "flat",
-        "flat:name",
-        "flat:foreign",
-        "nmod",
-        "nmod:gobj",
-        "nmod:gsubj",
-        "nmod:poss",
-        "nummod",
-    ]
+        threshold (float): The minimum probability of the predicted edit
+            tree. Less confident tokens are left without a lemma.
+        known_words_only (bool): Whether to leave also the words that
+            did not occur in the training data without a lemma.
 
-    def potential_np_head(word):
-        return word.pos in (NOUN, PROPN) and (
-            word.dep in np_deps or word.head.pos == PRON
+        See EditTreeLemmatizer for the other arguments.
+        """
+        super().__init__(
+            vocab,
+            model,
+            name,
+            backoff=None,
+            min_tree_freq=min_tree_freq,
+            overwrite=overwrite,
+            top_k=top_k,
+            scorer=scorer,
         )
+        self.threshold = threshold
+        self.known_words_only = known_words_only
+        self.cfg["known_words"] = []
+        self.known_words = set()
+
+    def initialize(
+        self,
+        get_examples: Callable[[], Iterable[Example]],
+        *,
+        nlp: Optional[Language] = None,
+        labels: Optional[Dict] = None,
+    ):
+        super().initialize(get_examples, nlp=nlp, labels=labels)
+        words = {token.lower_ for eg in get_examples() for token in eg.reference}
+        self.cfg["known_words"] = sorted(words)
+        self._known_words_changed()
+
+    def predict(self, docs: Iterable[Doc]) -> List[np.ndarray]:
+        """Predict the edit tree of each token. The tree ID is -1 for
+        tokens that should be lemmatized by Voikko.
+        """
+        docs = list(docs)
+        if not any(len(doc) for doc in docs):
+            return super().predict(docs)
+
+        scores = [self.numpy_ops.asarray(x) for x in self.model.predict(docs)]
+        probs = [self._probabilities(x) for x in scores]
+        if self.top_k == 1:
+            guesses = self._scores2guesses_top_k_equals_1(docs, scores)
+        else:
+            # Guessing modifies the scores in place
+            guesses = self._scores2guesses_top_k_greater_1(docs, [x.copy() for x in scores])
+
+        tree2label = self.tree2label
+        for doc, doc_guesses, doc_probs in zip(docs, guesses, probs):
+            applicable = doc_guesses != -1
+            labels = [tree2label.get(int(t), 0) for t in doc_guesses]
+            confidence = doc_probs[np.arange(len(doc)), labels]
+            doc_guesses[applicable & (confidence < self.threshold)] = -1
+            if self.known_words_only:
+                lower = doc.to_array("LOWER")
+                known = np.array([x in self.known_words for x in lower.tolist()], dtype=bool)
+                doc_guesses[~known] = -1
+        return guesses
+
+    def set_annotations(self, docs: Iterable[Doc], batch_tree_ids) -> None:
+        super().set_annotations(docs, batch_tree_ids)
+        if self.overwrite:
+            # Clear stale lemmas so that the Voikko lemmatizer will
+            # lemmatize the unpredicted tokens
+            for doc, doc_tree_ids in zip(docs, batch_tree_ids):
+                for i in np.flatnonzero(np.asarray(doc_tree_ids) == -1):
+                    doc[int(i)].lemma = 0
+
+    def _probabilities(self, scores: np.ndarray) -> np.ndarray:
+        softmax = self.model.get_ref("softmax") if self.model.has_ref("softmax") else None
+        if softmax is not None and softmax.attrs.get("softmax_normalize", True):
+            return scores
+        exp = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def _known_words_changed(self) -> None:
+        self.known_words = {hash_string(w) for w in self.cfg.get("known_words", [])}
+
+    def from_bytes(self, bytes_data, *, exclude=tuple()):
+        super().from_bytes(bytes_data, exclude=exclude)
+        self._known_words_changed()
+        return self
+
+    def from_disk(self, path, exclude=tuple()):
+        super().from_disk(path, exclude=exclude)
+        self._known_words_changed()
+        return self
+
+
+@Finnish.factory(
+    "confident_edit_tree_lemmatizer",
+    assigns=["token.lemma"],
+    requires=[],
+    default_config={
+        "model": DEFAULT_EDIT_TREE_LEMMATIZER_MODEL,
+        "min_tree_freq": 3,
+        "overwrite": False,
+        "top_k": 1,
+        "threshold": 0.9,
+        "known_words_only": False,
+        "scorer": {"@scorers": "spacy.lemmatizer_scorer.v1"},
+    },
+    default_score_weights={"lemma_acc": 1.0},
+)
+def make_confident_edit_tree_lemmatizer(
+    nlp: Language,
+    name: str,
+    model: Model,
+    min_tree_freq: int,
+    overwrite: bool,
+    top_k: int,
+    threshold: float,
+    known_words_only: bool,
+    scorer: Optional[Callable],
+):
+    return ConfidentEditTreeLemmatizer(
+        nlp.vocab,
+        model,
+        name,
+        min_tree_freq=min_tree_freq,
+        overwrite=overwrite,
+        top_k=top_k,
+        threshold=threshold,
+        known_words_only=known_words_only,
+        scorer=scorer,
+    )
+
+
+# Dependency labels of independent noun phrase heads and of the
+# dependents that extend a noun phrase. Dependency label IDs are either
+# symbols or string hashes, so they are the same in every vocab.
+NP_LABELS = ("appos", "nsubj", "nsubj:cop", "obj", "obl", "ROOT")
+NP_EXTEND_LABELS = (
+    "amod",
+    "compound",
+    "compound:nn",
+    "flat",
+    "flat:name",
+    "flat:foreign",
+    "nmod",
+    "nmod:gobj",
+    "nmod:gsubj",
+    "nmod:poss",
+    "nummod",
+)
+_np_label_ids = frozenset(StringStore()[x] for x in NP_LABELS)
+_np_extend_label_ids = frozenset(StringStore()[x] for x in NP_EXTEND_LABELS)
+_np_label_array = np.array(sorted(_np_label_ids), dtype=np.uint64)
+_np_extend_label_array = np.array(sorted(_np_extend_label_ids), dtype=np.uint64)
+
+# Docs with at least this many tokens are processed with vectorized NumPy
+# operations in noun_chunks()
+NOUN_CHUNKS_VECTORIZE_MIN_TOKENS = 128
+
 
-    def extend_right(word):
-        res = word.i
-        for rdep in word.rights:
-            if rdep.dep in extend_deps:
-                res = extend_right(rdep)
-        return res
+def _is_label(deps: np.ndarray, label_ids: np.ndarray) -> np.ndarray:
+    """Vectorized membership test of deps in a sorted array of label IDs."""
+    i = np.searchsorted(label_ids[:-1], deps)
+    return label_ids[i] == deps
 
+
+def _noun_chunk_structure(array: np.ndarray) -> Tuple[List[int], List[int], List[int]]:
+    """Find the noun phrase structure from an array of (POS, DEP, HEAD)
+    rows.
+
+    Returns the indices of the potential noun phrase heads, and the
+    index of the first left and the last right dependent of each token
+    that extends a noun phrase (-1 if there is none). The array can
+    contain the rows of several docs one after another.
+    """
+    n = len(array)
+    indices = np.arange(n)
+    heads = indices + array[:, 2].astype(np.int64)
+
+    if n < NOUN_CHUNKS_VECTORIZE_MIN_TOKENS:
+        pos = array[:, 0].tolist()
+        deps = array[:, 1].tolist()
+        heads = heads.tolist()
+        is_np_head = [
+            (p == NOUN or p == PROPN) and (d in _np_label_ids or pos[h] == PRON)
+            for p, d, h in zip(pos, deps, heads)
+        ]
+        candidates = [
+            i for i, (x, d, h) in enumerate(zip(is_np_head, deps, heads))
+            if x or (d == conj and is_np_head[h])
+        ]
+        first_left = [-1] * n
+        last_right = [-1] * n
+        for i, (d, h) in enumerate(zip(deps, heads)):
+            if d in _np_extend_label_ids:
+                if i < h:
+                    if first_left[h] == -1:
+                        first_left[h] = i
+                elif i > h:
+                    last_right[h] = i
+        return candidates, first_left, last_right
+
+    pos = array[:, 0]
+    deps = array[:, 1]
+    is_np_head = ((pos == NOUN) | (pos == PROPN)) & (
+        _is_label(deps, _np_label_array) | (pos[heads] == PRON)
+    )
+    is_candidate = is_np_head | ((deps == conj) & is_np_head[heads])
+    extends = _is_label(deps, _np_extend_label_array)
+    is_left = extends & (indices < heads)
+    first_left = np.full(n, n, dtype=np.int64)
+    np.minimum.at(first_left, heads[is_left], indices[is_left])
+    first_left[first_left == n] = -1
+    is_right = extends & (indices > heads)
+    last_right = np.full(n, -1, dtype=np.int64)
+    np.maximum.at(last_right, heads[is_right], indices[is_right])
+    candidates = np.flatnonzero(is_candidate).tolist()
+    return candidates, first_left.tolist(), last_right.tolist()
+
+
+def noun_chunks(doclike: Union[Doc, Span]) -> Iterator[Tuple[int, int, int]]:
+    """Detect base noun phrases from a dependency parse. Works on both Doc and Span.
+
+    The noun phrase heads and the dependents that extend them are found
+    from the POS, DEP and HEAD attributes (see _noun_chunk_structure()).
+    For a Span, only the sentences that overlap it are processed (see
+    _noun_chunk_region()). The noun chunks of a Doc are memoized until
+    its attributes change, because Span.noun_chunks filters
+    doc.noun_chunks, and iterating over the noun chunks of each sentence
+    would otherwise process the whole doc once for each sentence.
+    """
     doc = doclike.doc  # Ensure works on both Doc and Span.
     if not doc.has_annotation("DEP"):
         raise ValueError(Errors.E029)
 
-    np_deps = [doc.vocab.strings[label] for label in labels]
-    extend_deps = [doc.vocab.strings[label] for label in extend_labels]
     np_label = doc.vocab.strings.add("NP")
-    conj_label = doc.vocab.strings.add("conj")
+    if len(doclike) == 0:
+        return
+
+    if isinstance(doclike, Span):
+        lo, array = _noun_chunk_region(doc, doclike.start, doclike.end)
+        bounds = _noun_chunk_bounds_in_region(doc, lo, array, doclike.start, doclike.end)
+    else:
+        array = doc.to_array([POS, DEP, HEAD])
+        memo = _noun_chunk_memo.get(doc)
+        if memo is not None and np.array_equal(memo[0], array):
+            bounds = memo[1]
+        else:
+            bounds = _noun_chunk_bounds_in_region(doc, 0, array, 0, len(doc))
+            _noun_chunk_memo[doc] = (array, bounds)
+    for lbracket, rbracket in bounds:
+        yield lbracket, rbracket, np_label
+
+
+# Doc -> (the POS, DEP and HEAD array, the noun chunk bounds)
+_noun_chunk_memo: "weakref.WeakKeyDictionary[Doc, Tuple[np.ndarray, List[Tuple[int, int]]]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def _noun_chunk_region(doc: Doc, start: int, end: int) -> Tuple[int, np.ndarray]:
+    """Find the tokens that the noun chunks of doc[start:end] depend on.
 
+    Returns the start token index of the sentences that overlap
+    doc[start:end] and their (POS, DEP, HEAD) array. If a dependency
+    relation crosses the boundaries of the sentences, the whole doc is
+    returned.
+    """
+    lo = doc[start].sent.start
+    hi = doc[end - 1].sent.end
+    if lo == 0 and hi == len(doc):
+        return 0, doc.to_array([POS, DEP, HEAD])
+
+    array = doc[lo:hi].to_array([POS, DEP, HEAD])
+    relative_heads = array[:, 2].astype(np.int64)
+    heads = np.arange(hi - lo) + relative_heads
+    # The heads of the tokens are inside the region, and the subtrees
+    # of the roots don't extend outside it, so no token outside the
+    # region has a head inside it
+    closed = bool(((heads >= 0) & (heads < hi - lo)).all()) and all(
+        doc[lo + i].left_edge.i >= lo and doc[lo + i].right_edge.i < hi
+        for i in np.flatnonzero(relative_heads == 0).tolist()
+    )
+    if not closed:
+        return 0, doc.to_array([POS, DEP, HEAD])
+    return lo, array
+
+
+def _noun_chunk_bounds_in_region(
+        doc: Doc,
+        lo: int,
+        array: np.ndarray,
+        start: int,
+        end: int,
+) -> List[Tuple[int, int]]:
+    """The noun chunks of doc[start:end] from the (POS, DEP, HEAD) array
+    of the tokens that begin at doc[lo].
+    """
+    structure = _noun_chunk_structure(array)
+    left_edge = lambda i: doc[i + lo].left_edge.i - lo  # noqa: E731
+    return list(_noun_chunk_bounds(left_edge, structure, -lo, start, end))
+
+
+def _noun_chunk_bounds(
+        left_edge: Callable[[int], int],
+        structure: Tuple[List[int], List[int], List[int]],
+        offset: int,
+        start: int,
+        end: int,
+) -> Iterator[Tuple[int, int]]:
+    """Yield the start and end token indices of the noun chunks in
+    doc[start:end].
+
+    structure is the output of _noun_chunk_structure() on an array where
+    the rows of doc begin at offset. left_edge maps a row of the array to
+    the row of the token's left edge.
+    """
+    candidates, first_left, last_right = structure
+    candidates = candidates[bisect.bisect_left(candidates, offset + start):
+                            bisect.bisect_left(candidates, offset + end)]
+
+    # rbracket is a doc index but it is compared with the index in
+    # doc[start:end], as it has always been
     rbracket = 0
     prev_end = -1
-    for i, word in enumerate(doclike):
-        if i < rbracket:
-            continue
-
-        # Is this a potential independent NP head or coordinated with
-        # a NOUN that is itself an independent NP head?
+    for i in candidates:
+        # Each candidate is a potential independent NP head or
+        # coordinated with a NOUN that is itself an independent NP head
         #
         # e.g. "Terveyden ja hyvinvoinnin laitos"
-        if potential_np_head(word) or (
-            word.dep == conj_label and potential_np_head(word.head)
-        ):
-            # Try to extend to the left to include adjective/num
-            # modifiers, compound words etc.
-            lbracket = word.i
-            for ldep in word.lefts:
-                if ldep.dep in extend_deps:
-                    lbracket = ldep.left_edge.i
+        if i - offset - start < rbracket:
+            continue
+
+        # Try to extend to the left to include adjective/num
+        # modifiers, compound words etc.
+        lbracket = i - offset
+        if first_left[i] != -1:
+            lbracket = left_edge(first_left[i]) - offset
+
+        # Prevent nested chunks from being produced
+        if lbracket <= prev_end:
+            continue
+
+        # Try to extend the span to the right to capture
+        # noun phrase extensions
+        right = i
+        while last_right[right] != -1:
+            right = last_right[right]
+        rbracket = right - offset
+        prev_end = rbracket
+
+        yield lbracket, rbracket + 1
+
+
+class NounChunker(Pipe):
+    """Pipeline component that finds the noun chunks once and stores
+    them in doc.spans, which is serialized in DocBin.
+
+    The noun chunks are the same as doc.noun_chunks. The attributes of
+    all docs in a batch are processed together.
+    """
+
+    def __init__(self, vocab: Vocab, name: str = "noun_chunker", *, spans_key: str = "noun_chunks") -> None:
+        """Initialize the noun chunker.
+
+        vocab (Vocab): The shared vocabulary.
+        name (str): The component instance name.
+        spans_key (str): The key in doc.spans for the noun chunks.
+        """
+        self.vocab = vocab
+        self.name = name
+        self.spans_key = spans_key
+
+    def __call__(self, doc: Doc) -> Doc:
+        error_handler = self.get_error_handler()
+        try:
+            self.set_noun_chunks([doc])
+            return doc
+        except Exception as e:
+            error_handler(self.name, self, [doc], e)
+
+    def pipe(self, stream: Iterable[Doc], *, batch_size: int = 128) -> Iterator[Doc]:
+        """Apply the noun chunker to a stream of documents.
+
+        stream (Iterable[Doc]): A stream of documents.
+        batch_size (int): The number of documents to buffer.
+        YIELDS (Doc): Processed documents in order.
+        """
+        error_handler = self.get_error_handler()
+        for docs in util.minibatch(stream, size=batch_size):
+            try:
+                self.set_noun_chunks(docs)
+                yield from docs
+            except Exception as e:
+                error_handler(self.name, self, docs, e)
+
+    def set_noun_chunks(self, docs: Iterable[Doc]) -> None:
+        """Store the noun chunks of a batch of documents in doc.spans."""
+        docs = list(docs)
+        np_label = self.vocab.strings.add("NP")
+        for doc, bounds in zip(docs, self._find_noun_chunks(docs)):
+            doc.spans[self.spans_key] = [
+                Span(doc, start, end, label=np_label) for start, end in bounds
+            ]
+
+    def noun_chunk_arrays(
+            self,
+            stream: Iterable[Doc],
+            *,
+            batch_size: int = 1000,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find the noun chunks of a stream of documents without creating
+        Span objects.
+
+        Stored noun chunks (see set_noun_chunks()) are used when a doc has
+        them. The others are computed and are not stored.
+
+        stream (Iterable[Doc]): A stream of documents.
+        batch_size (int): The number of documents to process at a time.
+        RETURNS (Tuple[np.ndarray, np.ndarray, np.ndarray]): The index of
+            the doc in the stream, and the start and end token indices of
+            each noun chunk.
+        """
+        doc_indices = []
+        starts = []
+        ends = []
+        i = 0
+        for docs in util.minibatch(stream, size=batch_size):
+            stored = [self.spans_key in doc.spans for doc in docs]
+            computed = iter(self._find_noun_chunks(
+                [doc for doc, s in zip(docs, stored) if not s]))
+            for doc, s in zip(docs, stored):
+                if s:
+                    bounds = [(span.start, span.end) for span in doc.spans[self.spans_key]]
+                else:
+                    bounds = next(computed)
+                doc_indices.extend([i] * len(bounds))
+                starts.extend(start for start, _ in bounds)
+                ends.extend(end for _, end in bounds)
+                i += 1
+        return (
+            np.array(doc_indices, dtype=np.int64),
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+        )
+
+    def _find_noun_chunks(self, docs: List[Doc]) -> List[List[Tuple[int, int]]]:
+        """Return the (start, end) token indices of the noun chunks of each
+        doc. The POS, DEP and HEAD attributes of all docs are processed
+        as one array.
+        """
+        arrays = []
+        for doc in docs:
+            if len(doc) > 0 and not doc.has_annotation("DEP"):
+                raise ValueError(Errors.E029)
+            arrays.append(doc.to_array([POS, DEP, HEAD]))
+        offsets = [0]
+        for doc in docs:
+            offsets.append(offsets[-1] + len(doc))
+        if offsets[-1] == 0:
+            return [[] for _ in docs]
+
+        structure = _noun_chunk_structure(np.concatenate(arrays))
+        return [
+            list(_noun_chunk_bounds(
+                lambda i: doc[i - offset].left_edge.i + offset, structure, offset, 0, len(doc)))
+            for doc, offset in zip(docs, offsets)
+        ]
+
+
+@Finnish.factory(
+    "noun_chunker",
+    assigns=["doc.spans"],
+    requires=["token.dep", "token.head", "token.pos"],
+    default_config={"spans_key": "noun_chunks"},
+)
+def make_noun_chunker(nlp: Language, name: str, spans_key: str):
+    return NounChunker(nlp.vocab, name, spans_key=spans_key)
+
+
+def doc_bin_noun_chunks(
+        doc_bins: Iterable[Union[DocBin, str, Path]],
+        *,
+        batch_size: int = 1000,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Find the noun chunks of serialized docs without creating Doc
+    objects.
+
+    The POS, DEP and HEAD columns are read from the token arrays of one
+    DocBin at a time. The noun chunks are the same as doc.noun_chunks on
+    the docs returned by DocBin.get_docs().
+
+    doc_bins (Iterable[Union[DocBin, str, Path]]): DocBins or paths to
+        .spacy files.
+    batch_size (int): The number of documents to process at a time.
+    YIELDS (Tuple[np.ndarray, np.ndarray, np.ndarray]): For each DocBin,
+        the index of the doc in the DocBin, and the start and end token
+        indices of each noun chunk.
+    """
+    for doc_bin in doc_bins:
+        if not isinstance(doc_bin, DocBin):
+            doc_bin = DocBin().from_disk(doc_bin)
+
+        doc_indices = []
+        starts = []
+        ends = []
+        for batch_start in range(0, len(doc_bin.tokens), batch_size):
+            tokens = doc_bin.tokens[batch_start:batch_start + batch_size]
+            for i, bounds in enumerate(_find_doc_bin_noun_chunks(doc_bin.attrs, tokens)):
+                doc_indices.extend([batch_start + i] * len(bounds))
+                starts.extend(start for start, _ in bounds)
+                ends.extend(end for _, end in bounds)
+
+        yield (
+            np.array(doc_indices, dtype=np.int64),
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+        )
+
+
+def _find_doc_bin_noun_chunks(
+        attrs: List[int],
+        tokens: List[np.ndarray],
+) -> List[List[Tuple[int, int]]]:
+    """Return the (start, end) token indices of the noun chunks of each
+    doc in a batch of DocBin token arrays.
+    """
+    lengths = np.array([len(x) for x in tokens], dtype=np.int64)
+    if lengths.sum() == 0:
+        return [[] for _ in tokens]
+
+    flat = np.concatenate(tokens)
+    array = np.zeros((len(flat), 3), dtype=np.uint64)
+    for col, attr in enumerate([POS, DEP, HEAD]):
+        if attr in attrs:
+            array[:, col] = flat[:, attrs.index(attr)]
+
+    offsets = np.cumsum(lengths) - lengths
+    doc_of = np.repeat(np.arange(len(tokens)), lengths)
+    is_parsed = np.zeros(len(tokens), dtype=bool)
+    is_parsed[doc_of[array[:, 1] != 0]] = True
+    if not is_parsed[lengths > 0].all():
+        raise ValueError(Errors.E029)
+
+    rel_heads = array[:, 2].astype(np.int64)
+    heads = np.arange(len(flat)) + rel_heads
+    out_of_range = (heads < offsets[doc_of]) | (heads >= (offsets + lengths)[doc_of])
+    if out_of_range.any():
+        i = np.flatnonzero(out_of_range)[0]
+        raise ValueError(Errors.E190.format(
+            index=i - offsets[doc_of[i]], value=array[i, 2], rel_head_index=rel_heads[i]))
+
+    structure = _noun_chunk_structure(array)
+    left_edges = _left_edges(heads, lengths, doc_of).tolist()
+    return [
+        list(_noun_chunk_bounds(left_edges.__getitem__, structure, offset, 0, length))
+        for offset, length in zip(offsets.tolist(), lengths.tolist())
+    ]
+
+
+def _left_edges(heads: np.ndarray, lengths: np.ndarray, doc_of: np.ndarray) -> np.ndarray:
+    """Compute the left edges of the tokens of parsed docs like
+    Doc.from_array() does.
+
+    heads are the absolute head indices of the tokens of all docs one
+    after another. Like spaCy's set_children_from_heads(), the edges are
+    passed from children to heads in a forward and a backward pass over
+    the tokens. Because of non-projective parses, the passes are repeated
+    (at most 12 times) until the head of every token is in the sentence
+    given by the left edges of the roots.
+    """
+    n = len(heads)
+    indices = np.arange(n)
+    is_child = heads != indices
+    doc_first = (np.cumsum(lengths) - lengths)[doc_of]
+    is_doc_last = np.zeros(n, dtype=bool)
+    is_doc_last[np.cumsum(lengths)[lengths > 0] - 1] = True
+    left_edges = indices.copy()
+    active = np.ones(len(lengths), dtype=bool)
+    for _ in range(12):
+        children = is_child & active[doc_of]
+        left_edges = _pass_edges(left_edges, heads, children, indices < heads)
+        left_edges = _pass_edges(left_edges, heads, children, indices > heads)
+
+        # The sentences start at the left edges of the roots. A head may
+        # also be the first token of the next sentence.
+        is_boundary = is_doc_last.copy()
+        sent_starts = left_edges[~is_child]
+        is_boundary[sent_starts[sent_starts != doc_first[~is_child]]] = True
+        sent_start = np.maximum(
+            np.maximum.accumulate(np.where(is_boundary, indices, -1)), doc_first)
+        next_boundary = np.minimum.accumulate(np.where(is_boundary, indices, n)[::-1])[::-1]
+        sent_end = np.append(next_boundary[1:], n)
+        outside = ~is_doc_last & ((heads < sent_start) | (heads > sent_end))
+        done = np.ones(len(lengths), dtype=bool)
+        done[doc_of[outside]] = False
+        active &= ~done
+        if not active.any():
+            break
+    return left_edges
+
+
+def _pass_edges(
+        left_edges: np.ndarray,
+        heads: np.ndarray,
+        children: np.ndarray,
+        in_order: np.ndarray,
+) -> np.ndarray:
+    """One pass of set_children_from_heads() over the tokens, vectorized.
+
+    When a child is visited, the head's left edge is lowered to the
+    child's current left edge. A child's current left edge already
+    includes the children that were visited before it, which are the
+    children on the in_order side (in_order: child is visited before its
+    head).
+    """
+    current = left_edges.copy()
+    propagates = children & in_order
+    frontier = np.flatnonzero(propagates)
+    slot = np.empty(len(heads), dtype=np.int64)
+    while len(frontier) > 0:
+        targets = heads[frontier]
+        before = current[targets]
+        np.minimum.at(current, targets, current[frontier])
+        lowered = targets[(current[targets] < before) & propagates[targets]]
+        # Keep one position of each token
+        positions = np.arange(len(lowered))
+        slot[lowered] = positions
+        frontier = lowered[slot[lowered] == positions]
+
+    left_edges = left_edges.copy()
+    np.minimum.at(left_edges, heads[children], current[children])
+    return left_edges
+
+
+# The maximum number of compiled expressions in the cache directory
+REGEX_CACHE_MAX_FILES = 32
+
+
+def _regex_cache_dir() -> Optional[Path]:
+    """The directory for the compiled tokenizer expressions, or None if
+    the cache is disabled.
+
+    The cache is enabled by setting SPACYFI_CACHE_DIR to a directory.
+    """
+    path = os.environ.get("SPACYFI_CACHE_DIR")
+    return Path(path) if path else None
+
+
+def _prune_regex_cache(cache_dir: Path, tag: str) -> None:
+    """Remove the compiled expressions of other Python versions (the
+    files without the tag), and the least recently used expressions
+    beyond REGEX_CACHE_MAX_FILES.
+    """
+    current = []
+    for p in cache_dir.glob("regex-*.msgpack"):
+        try:
+            if p.name.startswith(f"regex-{tag}-"):
+                current.append((p.stat().st_mtime, p))
+            else:
+                p.unlink()
+        except OSError:
+            pass
+    current.sort(reverse=True)
+    for _, p in current[REGEX_CACHE_MAX_FILES:]:
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+@lru_cache(maxsize=None)
+def compile_cached_regex(expression: str) -> Pattern:
+    """Compile a regular expression and optionally cache the compiled
+    code on disk.
+
+    Compiling the long prefix, suffix and infix expressions takes most
+    of the time of creating a tokenizer. If SPACYFI_CACHE_DIR is set,
+    the compiled SRE code is stored in a file in that directory, and the
+    following processes load it from there. The file name has a tag of
+    the Python and SRE versions and a hash of the expression. The files
+    of other versions are removed, and at most REGEX_CACHE_MAX_FILES
+    files are kept.
+
+    The cache uses the internals of the re module of Python 3.11 and
+    later. On older versions, and if the cache can't be used, this is
+    the same as re.compile(). The compiled expressions are memoized in
+    the process in any case.
+    """
+    cache_dir = _regex_cache_dir()
+    if cache_dir is None:
+        return re.compile(expression)
+    try:
+        import _sre
+        from re import _compiler, _parser
+    except ImportError:
+        return re.compile(expression)
+    if array("I").itemsize != _sre.CODESIZE:
+        return re.compile(expression)
+
+    tag = hashlib.sha256(f"{sys.version}\0{_sre.MAGIC}".encode("utf-8")).hexdigest()[:16]
+    key = hashlib.sha256(expression.encode("utf-8")).hexdigest()
+    path = cache_dir / f"regex-{tag}-{key}.msgpack"
+    try:
+        msg = srsly.read_msgpack(path)
+        code = array("I")
+        code.frombytes(msg["code"])
+        compiled = _sre.compile(
+            expression, msg["flags"], code.tolist(), msg["groups"] - 1,
+            msg["groupindex"], tuple(msg["indexgroup"]),
+        )
+        # The modification time orders the files for pruning
+        os.utime(path)
+        return compiled
+    except (OSError, ValueError, KeyError, TypeError, RuntimeError):
+        pass
+
+    # The same steps as re.compile()
+    parsed = _parser.parse(expression, 0)
+    code = _compiler._code(parsed, 0)
+    groupindex = parsed.state.groupdict
+    indexgroup = [None] * parsed.state.groups
+    for k, i in groupindex.items():
+        indexgroup[i] = k
+    msg = {
+        "flags": parsed.state.flags,
+        "code": array("I", code).tobytes(),
+        "groups": parsed.state.groups,
+        "groupindex": groupindex,
+        "indexgroup": indexgroup,
+    }
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        srsly.write_msgpack(tmp_path, msg)
+        os.replace(tmp_path, path)
+        _prune_regex_cache(cache_dir, tag)
+    except OSError:
+        pass
+    return _sre.compile(
+        expression, parsed.state.flags, code, parsed.state.groups - 1,
+        groupindex, tuple(indexgroup),
+    )
+
+
+# The tokenizer functions in the order of AffixTable matches
+AFFIX_FUNCTIONS = ("prefix_search", "suffix_search", "infix_finditer", "token_match", "url_match")
+_INFIX_FUNCTION = AFFIX_FUNCTIONS.index("infix_finditer")
+_NO_AFFIX_MATCHES = (None, None, (), None, None)
+
+
+class _AffixMatch:
+    """A precomputed match. Implements the parts of re.Match that the
+    Tokenizer uses.
+    """
+    __slots__ = ("_start", "_end")
+
+    def __init__(self, start: int, end: int) -> None:
+        self._start = start
+        self._end = end
+
+    def start(self) -> int:
+        return self._start
+
+    def end(self) -> int:
+        return self._end
+
+    def span(self) -> Tuple[int, int]:
+        return (self._start, self._end)
+
+
+class _PrecomputedExpression:
+    """Wraps the search, finditer or match method of a compiled
+    expression. Strings in the index are answered from the index and
+    other strings by the wrapped method.
+    """
+
+    def __init__(self, method: Callable, function: int, index: Dict[str, tuple]) -> None:
+        self.method = method
+        # Tokenizer.to_bytes() serializes method.__self__.pattern
+        self.pattern = method.__self__.pattern
+        self._function = function
+        self._index = index
+
+    def _lookup(self, string: str):
+        found = self._index.get(string)
+        if found is None:
+            return self.method(string)
+        return found[self._function]
+
+    search = _lookup
+    match = _lookup
+
+    def finditer(self, string: str):
+        found = self._index.get(string)
+        if found is None:
+            return self.method(string)
+        return iter(found[self._function])
+
+
+def _unwrap_expression(method: Optional[Callable]) -> Optional[Callable]:
+    """Return the original method of a _PrecomputedExpression."""
+    wrapper = getattr(method, "__self__", None)
+    if isinstance(wrapper, _PrecomputedExpression):
+        return wrapper.method
+    return method
+
+
+def _expression_pattern(method: Optional[Callable]) -> Optional[str]:
+    """The expression of a compiled regex method, or None if method isn't
+    a method of a compiled regex.
+    """
+    pattern = getattr(getattr(method, "__self__", None), "pattern", None)
+    return pattern if isinstance(pattern, str) else None
+
+
+def _expression_digest(method: Optional[Callable]) -> Optional[str]:
+    """A hash of the expression of a compiled regex method, or None if
+    method isn't a method of a compiled regex.
+    """
+    pattern = _expression_pattern(method)
+    if pattern is None:
+        return None
+    return hashlib.sha256(f"{method.__name__}\0{pattern}".encode("utf-8")).hexdigest()
+
+
+class AffixTable:
+    """Precomputed matches of the tokenizer expressions on frequent strings.
+
+    The table contains the results of the prefix, suffix, infix,
+    token_match and url_match expressions on every string that the
+    tokenizer examines when it splits a set of frequent chunks. The cache
+    of split chunks in the spaCy Tokenizer starts empty in every new
+    tokenizer, but a FinnishTokenizer with an affix table can skip the
+    expressions on the frequent chunks from the start. The table is only
+    used for the expressions that are identical to the ones that it was
+    built with.
+
+    The matches are stored as an array of (string index, function index,
+    start, end) rows. The function index refers to AFFIX_FUNCTIONS.
+    """
+
+    def __init__(
+        self, digests: Sequence[Optional[str]], strings: List[str], matches: np.ndarray
+    ) -> None:
+        self.digests = list(digests)
+        self.strings = strings
+        self.matches = matches
+        self._index: Optional[Dict[str, tuple]] = None
+
+    @classmethod
+    def build(cls, tokenizer: Tokenizer, chunks: Iterable[str]) -> "AffixTable":
+        """Split chunks with the rules of tokenizer and precompute the
+        matches of the tokenizer expressions on all examined strings.
+        """
+        methods = [_unwrap_expression(getattr(tokenizer, name)) for name in AFFIX_FUNCTIONS]
+        digests = [_expression_digest(method) for method in methods]
+        examined: Dict[str, None] = {}
+
+        def recorder(method):
+            if method is None:
+                return None
+
+            def record(string):
+                examined[string] = None
+                return method(string)
+            return record
+
+        # A separate vocab, because the chunks shouldn't end up in the
+        # strings of the model. The chunk cache is disabled so that
+        # every chunk is split.
+        recording_tokenizer = Tokenizer(
+            Vocab(),
+            tokenizer.rules,
+            *[recorder(method) for method in methods],
+            faster_heuristics=tokenizer.faster_heuristics,
+            max_cache_size=0,
+        )
+        for chunk in chunks:
+            recording_tokenizer(chunk)
+
+        strings = list(examined)
+        rows = []
+        for i, string in enumerate(strings):
+            for function, (method, digest) in enumerate(zip(methods, digests)):
+                if digest is None:
+                    continue
+                elif function == _INFIX_FUNCTION:
+                    found = [m.span() for m in method(string)]
+                else:
+                    m = method(string)
+                    found = [m.span()] if m is not None else []
+                rows.extend((i, function, start, end) for start, end in found)
+
+        matches = np.array(rows, dtype=np.int32).reshape(-1, 4)
+        return cls(digests, strings, matches)
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __reduce__(self):
+        return (self.__class__.from_bytes, (self.to_bytes(),))
+
+    def index(self) -> Dict[str, tuple]:
+        """Return a dict from a string to a tuple of its matches in the
+        order of AFFIX_FUNCTIONS. The infix matches are a tuple of matches
+        and the other matches are either a match or None.
+        """
+        if self._index is None:
+            index = dict.fromkeys(self.strings, _NO_AFFIX_MATCHES)
+            match_objects: Dict[Tuple[int, int], _AffixMatch] = {}
+            rows = self.matches.tolist()
+            for i, string_rows in groupby(rows, key=lambda row: row[0]):
+                found: List[Any] = list(_NO_AFFIX_MATCHES)
+                for _, function, start, end in string_rows:
+                    m = match_objects.get((start, end))
+                    if m is None:
+                        m = match_objects[(start, end)] = _AffixMatch(start, end)
+                    if function == _INFIX_FUNCTION:
+                        found[function] = found[function] + (m,)
+                    else:
+                        found[function] = m
+                index[self.strings[i]] = tuple(found)
+            self._index = index
+        return self._index
+
+    def wrap(self, methods: Sequence[Optional[Callable]]) -> List[Optional[Callable]]:
+        """Wrap the tokenizer methods (in the order of AFFIX_FUNCTIONS) so
+        that they look up the strings in this table first. Methods with a
+        different expression than the table was built with are returned
+        as they are.
+        """
+        wrapped = []
+        for function, (method, digest) in enumerate(zip(methods, self.digests)):
+            method = _unwrap_expression(method)
+            if digest is not None and _expression_digest(method) == digest:
+                wrapper = _PrecomputedExpression(method, function, self.index())
+                method = getattr(wrapper, method.__name__)
+            wrapped.append(method)
+        return wrapped
+
+    def to_bytes(self) -> bytes:
+        return srsly.msgpack_dumps({
+            "digests": self.digests,
+            "strings": self.strings,
+            "matches": self.matches.astype("<i4").tobytes(),
+        })
+
+    @classmethod
+    def from_bytes(cls, bytes_data: bytes) -> "AffixTable":
+        data = srsly.msgpack_loads(bytes_data)
+        matches = np.frombuffer(data["matches"], dtype="<i4").reshape(-1, 4)
+        return cls(data["digests"], data["strings"], matches)
+
+    def to_disk(self, path: Union[str, Path]) -> None:
+        with util.ensure_path(path).open("wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def from_disk(cls, path: Union[str, Path]) -> "AffixTable":
+        with util.ensure_path(path).open("rb") as f:
+            return cls.from_bytes(f.read())
+
+
+class FinnishTokenizer(Tokenizer):
+    """The spaCy Tokenizer with an optional AffixTable.
+
+    The tokens are the same with and without the table. The table is
+    saved with the tokenizer, and the expressions are compiled by
+    compile_cached_regex() when the tokenizer is loaded.
+    """
+
+    def __init__(
+        self,
+        vocab: Vocab,
+        rules: Optional[Dict[str, Any]] = None,
+        prefix_search: Optional[Callable] = None,
+        suffix_search: Optional[Callable] = None,
+        infix_finditer: Optional[Callable] = None,
+        token_match: Optional[Callable] = None,
+        url_match: Optional[Callable] = None,
+        faster_heuristics: bool = True,
+        max_cache_size: int = 10000,
+        affix_table: Optional[AffixTable] = None,
+    ) -> None:
+        self._affix_table = affix_table
+        methods = [prefix_search, suffix_search, infix_finditer, token_match, url_match]
+        if affix_table is not None:
+            methods = affix_table.wrap(methods)
+        super().__init__(
+            vocab, rules, *methods,
+            faster_heuristics=faster_heuristics, max_cache_size=max_cache_size,
+        )
+
+    @property
+    def affix_table(self) -> Optional[AffixTable]:
+        return self._affix_table
+
+    @affix_table.setter
+    def affix_table(self, affix_table: Optional[AffixTable]) -> None:
+        self._affix_table = affix_table
+        methods = [_unwrap_expression(getattr(self, name)) for name in AFFIX_FUNCTIONS]
+        if affix_table is not None:
+            methods = affix_table.wrap(methods)
+        # Every setter reloads the special cases. Clear the rules first
+        # so that they are loaded only once.
+        rules = self.rules
+        self.rules = {}
+        for name, method in zip(AFFIX_FUNCTIONS, methods):
+            setattr(self, name, method)
+        self.rules = rules
+
+    def __reduce__(self):
+        args = (
+            self.vocab,
+            self.rules,
+            *[_unwrap_expression(getattr(self, name)) for name in AFFIX_FUNCTIONS],
+            self.faster_heuristics,
+            self.max_cache_size,
+            self.affix_table,
+        )
+        return (self.__class__, args, None, None)
+
+    def initialize(
+        self,
+        get_examples: Optional[Callable[[], Iterable[Example]]] = None,
+        *,
+        nlp: Optional[Language] = None,
+        affix_table: Optional[AffixTable] = None,
+    ) -> None:
+        """Set the affix table from the [initialize.tokenizer] settings.
+
+        affix_table (AffixTable): Precomputed matches of the tokenizer
+            expressions on frequent strings. Defaults to None.
+        """
+        self.affix_table = affix_table
+
+    def to_bytes(self, *, exclude=tuple()) -> bytes:
+        serializers = {
+            "vocab": lambda: self.vocab.to_bytes(exclude=exclude),
+            "exceptions": lambda: dict(sorted(self.rules.items())),
+            "faster_heuristics": lambda: self.faster_heuristics,
+            "affix_table": lambda: (
+                self._affix_table.to_bytes() if self._affix_table is not None else None
+            ),
+        }
+        for name in AFFIX_FUNCTIONS:
+            method = getattr(self, name)
+            serializers[name] = lambda method=method: (
+                method.__self__.pattern if method is not None else None
+            )
+        return util.to_bytes(serializers, exclude)
+
+    def from_bytes(self, bytes_data: bytes, *, exclude=tuple()) -> "FinnishTokenizer":
+        data: Dict[str, Any] = {}
+        deserializers = {
+            "vocab": lambda b: self.vocab.from_bytes(b, exclude=exclude),
+            "exceptions": lambda b: data.setdefault("rules", b),
+            "faster_heuristics": lambda b: data.setdefault("faster_heuristics", b),
+            "affix_table": lambda b: data.setdefault("affix_table", b),
+        }
+        for name in AFFIX_FUNCTIONS:
+            deserializers[name] = lambda b, name=name: data.setdefault(name, b)
+        # Like Tokenizer.from_bytes(), but the current methods are kept
+        # if their expressions are the same, and the other expressions
+        # are compiled by compile_cached_regex(). The rules are reset
+        # first and loaded last so that the special cases are loaded only
+        # once.
+        current = {name: _unwrap_expression(getattr(self, name)) for name in AFFIX_FUNCTIONS}
+        self.rules = {}
+        for name in AFFIX_FUNCTIONS:
+            setattr(self, name, None)
+        self._affix_table = None
+        util.from_bytes(bytes_data, deserializers, exclude)
+        methods: List[Optional[Callable]] = []
+        for name in AFFIX_FUNCTIONS:
+            pattern = data.get(name)
+            # The method name is the last part of the function name:
+            # search, finditer or match
+            method_name = name.split("_")[-1]
+            if isinstance(pattern, str) and pattern == _expression_pattern(current[name]) \
+                    and current[name].__name__ == method_name:
+                methods.append(current[name])
+            elif isinstance(pattern, str):
+                methods.append(getattr(compile_cached_regex(pattern), method_name))
+            else:
+                methods.append(None)
+        if isinstance(data.get("affix_table"), bytes):
+            self._affix_table = AffixTable.from_bytes(data["affix_table"])
+            methods = self._affix_table.wrap(methods)
+        for name, method in zip(AFFIX_FUNCTIONS, methods):
+            setattr(self, name, method)
+        if "faster_heuristics" in data:
+            self.faster_heuristics = data["faster_heuristics"]
+        if isinstance(data.get("rules"), dict):
+            self.rules = data["rules"]
+        return self
+
+
+# Suffixes longer than this are searched for separately in the whole chunk
+MAX_SUFFIX_WINDOW = 16
+
+# Character classes in a parsed expression
+_CATEGORY_EXPRESSIONS = {
+    "CATEGORY_DIGIT": r"\d",
+    "CATEGORY_NOT_DIGIT": r"\D",
+    "CATEGORY_SPACE": r"\s",
+    "CATEGORY_NOT_SPACE": r"\S",
+    "CATEGORY_WORD": r"\w",
+    "CATEGORY_NOT_WORD": r"\W",
+}
+
+
+class ExpressionInfo(NamedTuple):
+    # An expression that matches the characters that can start a match,
+    # or None if they are unknown or if the expression can match an
+    # empty string
+    first_chars: Optional[str]
+    min_width: int
+    max_width: int
+    # The (kind, contents) pairs of first_chars (see _class_items())
+    first_char_classes: Optional[Tuple[Tuple[str, str], ...]] = None
+
+
+def _char_expression(ch: int) -> str:
+    return f"\\U{ch:08x}"
+
+
+def _range_expression(lo: int, hi: int) -> str:
+    return f"{_char_expression(lo)}-{_char_expression(hi)}"
+
+
+def _class_items(items: Sequence, constants: Any) -> Optional[List[Tuple[str, str]]]:
+    """Convert a parsed character class to (kind, contents) pairs, where
+    kind is "chars", "astral" (characters outside the BMP) or "negated".
+    Returns None if the class has unsupported items.
+    """
+    negated = False
+    chars = []
+    astral = []
+    for op, av in items:
+        if op is constants.NEGATE:
+            negated = True
+        elif op is constants.LITERAL:
+            (astral if av > 0xFFFF else chars).append(_char_expression(av))
+        elif op is constants.RANGE:
+            lo, hi = av
+            if lo <= 0xFFFF:
+                chars.append(_range_expression(lo, min(hi, 0xFFFF)))
+            if hi > 0xFFFF:
+                astral.append(_range_expression(max(lo, 0x10000), hi))
+        elif op is constants.CATEGORY and getattr(av, "name", None) in _CATEGORY_EXPRESSIONS:
+            chars.append(_CATEGORY_EXPRESSIONS[av.name])
+        else:
+            return None
+    if negated:
+        return [("negated", "".join(chars + astral))]
+    return [("chars", x) for x in chars] + [("astral", x) for x in astral]
+
+
+def _first_chars(items: Sequence, constants: Any) -> Tuple[Optional[List[Tuple[str, str]]], bool]:
+    """Find the characters that can start a match of a parsed expression.
+
+    Returns the characters as (kind, contents) pairs (see _class_items()),
+    or None if they can't be determined, and whether the expression can
+    match an empty string. Anchors and lookarounds are skipped, because
+    they don't consume characters.
+    """
+    c = constants
+    chars: List[Tuple[str, str]] = []
+    for op, av in items:
+        if op in (c.AT, c.ASSERT, c.ASSERT_NOT):
+            continue
+        elif op is c.LITERAL:
+            return chars + _class_items([(op, av)], c), False
+        elif op is c.NOT_LITERAL:
+            return chars + [("negated", _char_expression(av))], False
+        elif op is c.IN:
+            class_items = _class_items(av, c)
+            return (chars + class_items if class_items is not None else None), False
+        elif op is c.SUBPATTERN and not av[1] and not av[2]:
+            first, nullable = _first_chars(av[3], c)
+        elif op is c.ATOMIC_GROUP:
+            first, nullable = _first_chars(av, c)
+        elif op is c.BRANCH:
+            first, nullable = [], False
+            for branch in av[1]:
+                branch_first, branch_nullable = _first_chars(branch, c)
+                if branch_first is None:
+                    return None, False
+                first.extend(branch_first)
+                nullable = nullable or branch_nullable
+        elif op in (c.MAX_REPEAT, c.MIN_REPEAT, c.POSSESSIVE_REPEAT):
+            first, nullable = _first_chars(av[2], c)
+            nullable = nullable or av[0] == 0
+        else:
+            return None, False
+
+        if first is None:
+            return None, False
+        chars.extend(first)
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+@lru_cache(maxsize=None)
+def expression_info(expression: str) -> Optional[ExpressionInfo]:
+    """Analyze a regular expression. Returns None if the expression can't
+    be analyzed.
+    """
+    try:
+        from re import _constants, _parser
+    except ImportError:
+        return None
+    parsed = _parser.parse(expression)
+    min_width, max_width = parsed.getwidth()
+    chars, nullable = _first_chars(parsed, _constants)
+    if parsed.state.flags & ~re.UNICODE or chars is None or nullable:
+        return ExpressionInfo(None, min_width, max_width)
+    return ExpressionInfo(_first_chars_expression(chars), min_width, max_width, tuple(chars))
+
+
+def _first_chars_expression(chars: Sequence[Tuple[str, str]]) -> str:
+    """An expression that matches one of the characters of (kind,
+    contents) pairs (see _class_items()).
+    """
+    # The characters outside the BMP are in a separate class, so that
+    # the BMP characters can be looked up in a table.
+    expressions = [f"[^{x}]" for kind, x in chars if kind == "negated"]
+    bmp = "".join(x for kind, x in chars if kind == "chars")
+    astral = "".join(x for kind, x in chars if kind == "astral")
+    if bmp:
+        expressions.insert(0, f"[{bmp}]")
+    if astral:
+        expressions.append(f"(?=[\\U00010000-\\U0010ffff])[{astral}]")
+    return "|".join(expressions)
+
+
+# The number of calls after which an AffixMatcher starts to dispatch the
+# expressions by the first character. The earlier calls use the combined
+# expression. The analysis of the expressions takes tens of
+# milliseconds, so it is not done when the tokenizer loads its special
+# cases or when only a few texts are tokenized.
+AFFIX_MATCHER_WARMUP_CALLS = 5000
+
+
+class _AffixDispatch:
+    """The analyzed expressions of AffixMatchers. The matchers that have
+    the same expressions share one instance (see _affix_dispatch()).
+    """
+
+    def __init__(
+            self,
+            alternatives: Sequence[str],
+            first_chars: List[Optional[Pattern]],
+            scan: Optional[Pattern],
+            window: int,
+            long_suffixes: Optional[Pattern],
+    ) -> None:
+        self.alternatives = alternatives
+        # The characters that can start each alternative
+        self.first_chars = first_chars
+        # The characters that can start an infix
+        self.scan = scan
+        # The suffixes up to this length are dispatched, the longer
+        # suffixes are searched with long_suffixes
+        self.window = window
+        self.long_suffixes = long_suffixes
+        self._by_char: Dict[str, Optional[Pattern]] = {}
+        self._by_pattern: Dict[str, Pattern] = {}
+
+    def for_char(self, ch: str) -> Optional[Pattern]:
+        """The alternation of the expressions that can start with ch."""
+        try:
+            return self._by_char[ch]
+        except KeyError:
+            pass
+        alternatives = [
+            x for x, first_chars in zip(self.alternatives, self.first_chars)
+            if first_chars is None or first_chars.match(ch)
+        ]
+        if not alternatives:
+            self._by_char[ch] = None
+            return None
+        # Many characters have the same alternatives
+        pattern = "|".join(alternatives)
+        compiled = self._by_pattern.get(pattern)
+        if compiled is None:
+            compiled = self._by_pattern[pattern] = re.compile(pattern)
+        self._by_char[ch] = compiled
+        return compiled
+
+
+@lru_cache(maxsize=16)
+def _affix_dispatch(kind: str, alternatives: Tuple[str, ...]) -> Optional[_AffixDispatch]:
+    """Analyze the expressions of an AffixMatcher. Returns None if they
+    can't be dispatched by the first character.
+    """
+    infos = [expression_info(x) for x in alternatives]
+    if not infos or any(info is None or info.min_width == 0 for info in infos):
+        # Empty matches would need the full semantics of re.finditer()
+        return None
+
+    # The analysis is done after the tokenizer has been created, so the
+    # expressions are not cached on disk (see compile_cached_regex())
+    first_chars = [
+        re.compile(info.first_chars) if info.first_chars is not None else None
+        for info in infos
+    ]
+    scan = None
+    window = 0
+    long_suffixes = None
+    if kind == "infix":
+        if any(info.first_char_classes is None for info in infos):
+            return None
+        scan = re.compile(_first_chars_expression(
+            [x for info in infos for x in info.first_char_classes]))
+    elif kind == "suffix":
+        long = [x for x, info in zip(alternatives, infos) if info.max_width > MAX_SUFFIX_WINDOW]
+        window = max((info.max_width for info in infos
+                      if info.max_width <= MAX_SUFFIX_WINDOW), default=0)
+        if long:
+            long_suffixes = re.compile("|".join(long))
+    return _AffixDispatch(alternatives, first_chars, scan, window, long_suffixes)
+
+
+class AffixMatcher:
+    """The prefix, suffix or infix expressions of the tokenizer.
+
+    Gives the same results as the combined expression that spaCy compiles
+    from the rules (see spacy.util.compile_prefix_regex() and the other
+    functions), but is faster. The combined expression is an alternation
+    of dozens of expressions, many of them with lookbehinds, and the
+    regex engine tries all of them at every position of a chunk.
+
+    AffixMatcher finds the characters that can start each expression.
+    Only the expressions that can start with the character at a position
+    are tried there, and they are tried only at the positions where a
+    match can start:
+
+    * prefixes at the first character of the chunk,
+    * suffixes at the last MAX_SUFFIX_WINDOW characters, and the longer
+      suffixes, such as "\\.\\.+", separately,
+    * infixes at the characters that can start an infix, which are
+      found by a single scan of the chunk.
+
+    The first warmup_calls calls (AFFIX_MATCHER_WARMUP_CALLS by default)
+    use the combined expression, and the expressions are analyzed after
+    them. The expressions for each character are compiled when the
+    character is seen the first time. The search() (for prefixes and
+    suffixes) and finditer() (for infixes) methods are used as the
+    tokenizer functions.
+
+    The analysis uses the internals of the re module of Python 3.11 and
+    later. On older versions, the combined expression is always used.
+    """
+
+    def __init__(self, kind: str, entries: Iterable[str], warmup_calls: Optional[int] = None) -> None:
+        if kind not in ("prefix", "suffix", "infix"):
+            raise ValueError(f"Unknown affix kind: {kind}")
+
+        self.kind = kind
+        # Like spacy.util.compile_*_regex()
+        self.entries = [x for x in entries if x.strip()]
+        if kind == "prefix":
+            self.alternatives = ["^" + x for x in self.entries]
+        elif kind == "suffix":
+            self.alternatives = [x + "$" for x in self.entries]
+        else:
+            self.alternatives = self.entries
+        self.pattern = "|".join(self.alternatives)
+        self.warmup_calls = AFFIX_MATCHER_WARMUP_CALLS if warmup_calls is None else warmup_calls
+        self._regex = compile_cached_regex(self.pattern)
+        self._calls_left = self.warmup_calls
+        self._analyzed = False
+        self._dispatch: Optional[_AffixDispatch] = None
+
+    def __reduce__(self):
+        return (self.__class__, (self.kind, self.entries, self.warmup_calls))
+
+    def _start_dispatch(self) -> bool:
+        """Count the calls during the warmup, and analyze the expressions
+        after it. Returns whether the expressions are dispatched.
+        """
+        if self._calls_left > 0:
+            self._calls_left -= 1
+            return False
+        if not self._analyzed:
+            self._dispatch = _affix_dispatch(self.kind, tuple(self.alternatives))
+            self._analyzed = True
+        return self._dispatch is not None
+
+    def search(self, string: str) -> Optional[Any]:
+        """Find the prefix or the suffix of string like re.search() of the
+        combined expression."""
+        dispatch = self._dispatch
+        if dispatch is None:
+            if not self._start_dispatch():
+                return self._regex.search(string)
+            dispatch = self._dispatch
+        if not string:
+            return self._regex.search(string)
+
+        if self.kind == "prefix":
+            expression = dispatch.for_char(string[0])
+            return expression.match(string) if expression is not None else None
+
+        if "\n" in string:
+            # $ matches also before a final newline
+            return self._regex.search(string)
+        # All suffix matches end at the end of the string, so the
+        # leftmost one is the result. The lookbehinds see the characters
+        # before the position.
+        n = len(string)
+        m = None
+        for i in range(max(0, n - dispatch.window), n):
+            expression = dispatch.for_char(string[i])
+            if expression is not None:
+                m = expression.match(string, i)
+                if m is not None:
                     break
+        if dispatch.long_suffixes is not None:
+            long_m = dispatch.long_suffixes.search(string)
+            if long_m is not None and (m is None or long_m.start() < m.start()):
+                m = long_m
+        return m
+
+    def finditer(self, string: str) -> Iterator:
+        """Find the infixes of string like re.finditer() of the combined
+        expression."""
+        dispatch = self._dispatch
+        if dispatch is None:
+            if not self._start_dispatch():
+                return self._regex.finditer(string)
+            dispatch = self._dispatch
+
+        matches = []
+        pos = 0
+        scan = dispatch.scan
+        while True:
+            candidate = scan.search(string, pos)
+            if candidate is None:
+                break
+            i = candidate.start()
+            expression = dispatch.for_char(string[i])
+            m = expression.match(string, i) if expression is not None else None
+            if m is None:
+                pos = i + 1
+            else:
+                matches.append(m)
+                pos = m.end()
+        return iter(matches)
 
-            # Prevent nested chunks from being produced
-            if lbracket <= prev_end:
-                continue
 
-            # Try to extend the span to the right to capture
-            # noun phrase extensions
-            rbracket = extend_right(word)
-            prev_end = rbracket
+@util.registry.tokenizers("spacyfi.CachedTokenizer.v1")
+def create_cached_tokenizer() -> Callable[[Language], FinnishTokenizer]:
+    """The same tokenizer as spacy.Tokenizer.v1, but the prefix, suffix
+    and infix expressions are compiled by compile_cached_regex(), and an
+    AffixTable can be set in [initialize.tokenizer].
+    """
+
+    def tokenizer_factory(nlp: Language) -> FinnishTokenizer:
+        # The expressions are built like in spacy.util.compile_*_regex()
+        prefixes = [x for x in nlp.Defaults.prefixes or [] if x.strip()]
+        suffixes = [x for x in nlp.Defaults.suffixes or [] if x.strip()]
+        infixes = [x for x in nlp.Defaults.infixes or [] if x.strip()]
+        prefix_search = compile_cached_regex("|".join("^" + x for x in prefixes)).search \
+            if prefixes else None
+        suffix_search = compile_cached_regex("|".join(x + "$" for x in suffixes)).search \
+            if suffixes else None
+        infix_finditer = compile_cached_regex("|".join(infixes)).finditer \
+            if infixes else None
+        return FinnishTokenizer(
+            nlp.vocab,
+            rules=nlp.Defaults.tokenizer_exceptions,
+            prefix_search=prefix_search,
+            suffix_search=suffix_search,
+            infix_finditer=infix_finditer,
+            token_match=nlp.Defaults.token_match,
+            url_match=nlp.Defaults.url_match,
+        )
+
+    return tokenizer_factory
+
+
+@util.registry.tokenizers("spacyfi.Tokenizer.v1")
+def create_tokenizer(
+        warmup_calls: int = AFFIX_MATCHER_WARMUP_CALLS,
+) -> Callable[[Language], FinnishTokenizer]:
+    """The same tokenizer as spacyfi.CachedTokenizer.v1, but the prefix,
+    suffix and infix expressions are matched by AffixMatcher. The tokens
+    are the same. It is faster on Python 3.11 and later.
+
+    warmup_calls (int): The number of calls of each AffixMatcher that use
+        the combined expression.
+    """
+
+    def tokenizer_factory(nlp: Language) -> FinnishTokenizer:
+        prefixes = AffixMatcher("prefix", nlp.Defaults.prefixes or [], warmup_calls)
+        suffixes = AffixMatcher("suffix", nlp.Defaults.suffixes or [], warmup_calls)
+        infixes = AffixMatcher("infix", nlp.Defaults.infixes or [], warmup_calls)
+        return FinnishTokenizer(
+            nlp.vocab,
+            rules=nlp.Defaults.tokenizer_exceptions,
+            prefix_search=prefixes.search if prefixes.entries else None,
+            suffix_search=suffixes.search if suffixes.entries else None,
+            infix_finditer=infixes.finditer if infixes.entries else None,
+            token_match=nlp.Defaults.token_match,
+            url_match=nlp.Defaults.url_match,
+        )
+
+    return tokenizer_factory
+
+
+# AffixMatcher dispatches the expressions only on Python 3.11 and later
+if sys.version_info >= (3, 11):
+    DEFAULT_TOKENIZER = "spacyfi.Tokenizer.v1"
+else:
+    DEFAULT_TOKENIZER = "spacyfi.CachedTokenizer.v1"
+
+DEFAULT_CONFIG = f"""
+[nlp]
 
-            yield lbracket, rbracket + 1, np_label
+[nlp.tokenizer]
+@tokenizers = "{DEFAULT_TOKENIZER}"
+"""
 
 
 class FinnishExDefaults(FinnishDefaults):
+    config = load_config_from_str(DEFAULT_CONFIG)
     prefixes = _prefixes
     infixes = _infixes
     suffixes = _suffixes
@@ -520,6 +3323,27 @@ class FinnishExtended(Language):
     Defaults = FinnishExDefaults
 
 
+@util.registry.misc("spacyfi.read_analysis_store.v1")
+def create_analysis_store_reader(path: Optional[Path]) -> Optional[AnalysisStore]:
+    if path is None:
+        return None
+    return AnalysisStore.from_disk(path)
+
+
+@util.registry.misc("spacyfi.read_lemma_table.v1")
+def create_lemma_table_reader(path: Optional[Path]) -> Optional[LemmaTable]:
+    if path is None:
+        return None
+    return LemmaTable.from_disk(path)
+
+
+@util.registry.misc("spacyfi.read_affix_table.v1")
+def create_affix_table_reader(path: Optional[Path]) -> Optional[AffixTable]:
+    if path is None:
+        return None
+    return AffixTable.from_disk(path)
+
+
 @util.registry.misc("spacyfi.read_lookups_from_json.v1")
 def create_lookups_from_json_reader(path: Path) -> Lookups:
     lookups = Lookups()
@@ -1,8 +1,20 @@
+import pickle
 import pytest
-from fi.fi import create_lookups_from_json_reader, VoikkoLemmatizer
+from concurrent.futures import ThreadPoolExecutor
+from fi import FinnishExtended
+from fi.fi import create_lookups_from_json_reader, get_voikko_pool, parse_analysis_structure
+from fi.fi import BoundedCache, AnalysisStore, LemmaTable, VoikkoAnalysis, VoikkoLemmatizer, VoikkoPool, WordBase
 from pathlib import Path
 from spacy.lang.fi import Finnish
-from spacy.tokens import Doc
+from spacy.tokens import Doc, DocBin
+from spacy.training import Example
+
+
+LOOKUPS_PATH = Path(__file__).parent.parent.parent / 'fi' / 'lookups' / 'lemmatizer'
+
+
+def load_lookups():
+    return create_lookups_from_json_reader(LOOKUPS_PATH)
 
 
 XFAIL = 1
@@ -404,8 +416,7 @@ testcases = {
 def check(cases, case_filter=None, accept_less_common=True):
     nlp = Finnish()
     lemmatizer = VoikkoLemmatizer(nlp.vocab)
-    lemmatizer.initialize(lookups = create_lookups_from_json_reader(
-        Path(__file__).parent.parent.parent / 'fi' / 'lookups' / 'lemmatizer'))
+    lemmatizer.initialize(lookups=load_lookups())
 
     expanded = []
     for pos, tokens in cases.items():
@@ -446,3 +457,617 @@ def test_lemmas_xfail():
     failed, failed_prop = check(testcases, case_filter=XFAIL)
 
     assert len(failed) == 0
+
+
+def test_bounded_cache_lru_eviction():
+    cache = BoundedCache(maxsize=2, policy="lru")
+    cache.put("a", [1])
+    cache.put("b", [2])
+    assert cache.get("a") == [1]
+    cache.put("c", [3])
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.info() == {"hits": 1, "misses": 0, "evictions": 1, "size": 2, "maxsize": 2}
+
+
+def test_bounded_cache_fifo_eviction():
+    cache = BoundedCache(maxsize=2, policy="fifo")
+    cache.put("a", [1])
+    cache.put("b", [2])
+    assert cache.get("a") == [1]
+    assert cache.get("x") is None
+    cache.put("c", [3])
+
+    assert "a" not in cache
+    assert "b" in cache
+    assert cache.info() == {"hits": 1, "misses": 1, "evictions": 1, "size": 2, "maxsize": 2}
+
+
+def test_bounded_cache_disabled():
+    cache = BoundedCache(maxsize=0)
+    cache.put("a", [1])
+
+    assert len(cache) == 0
+    assert cache.get("a") is None
+
+
+def test_bounded_cache_invalid_policy():
+    with pytest.raises(ValueError):
+        BoundedCache(policy="random")
+
+
+def test_lemmatizer_caches_analyses():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, analysis_cache_size=10, lemma_cache_size=0)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    doc1 = lemmatizer(Doc(vocab=nlp.vocab, words=['tilassa', 'ja'], pos=['NOUN', 'CCONJ']))
+    doc2 = lemmatizer(Doc(vocab=nlp.vocab, words=['talossa', 'tilassa'], pos=['NOUN', 'NOUN']))
+
+    assert [t.lemma_ for t in doc1] == ['tila', 'ja']
+    assert [t.lemma_ for t in doc2] == ['talo', 'tila']
+    assert lemmatizer.analysis_cache.misses == 3
+    assert lemmatizer.analysis_cache.hits == 1
+
+
+def test_analysis_cache_keeps_casings_apart():
+    store = AnalysisStore.build([
+        ('Turku', [{'BASEFORM': 'Turku', 'CLASS': 'paikannimi'}]),
+        ('turku', []),
+    ])
+    nlp = Finnish()
+    lookups = load_lookups()
+
+    for words in [['Turku', 'turku'], ['turku', 'Turku']]:
+        lemmatizer = VoikkoLemmatizer(nlp.vocab)
+        lemmatizer.initialize(lookups=lookups, analysis_store=store)
+        for word in words:
+            lemmatizer(Doc(vocab=nlp.vocab, words=[word], pos=['PROPN']))
+
+        assert len(lemmatizer.analysis_cache) == 2
+        assert lemmatizer._voikko_analyze('Turku') == store.get('Turku')
+        assert lemmatizer._voikko_analyze('turku') == ()
+
+
+STORE_ANALYSES = [
+    ('on', [{'BASEFORM': 'olla', 'CLASS': 'teonsana'}]),
+    ('talossa', [{'BASEFORM': 'talo', 'CLASS': 'nimisana', 'SIJAMUOTO': 'sisaolento'}]),
+    ('xyz', []),
+]
+
+
+def test_voikko_analysis_from_voikko():
+    analysis = VoikkoAnalysis.from_voikko({
+        'BASEFORM': 'talo',
+        'CLASS': 'nimisana',
+        'SIJAMUOTO': 'sisaolento',
+        'WEIGHT': '0.5',
+    })
+
+    assert analysis.baseform == 'talo'
+    assert analysis.word_class == 'nimisana'
+    assert analysis.sijamuoto == 'sisaolento'
+    assert analysis.participle is None
+
+
+def test_analysis_store_get():
+    store = AnalysisStore.build(STORE_ANALYSES)
+
+    assert len(store) == 3
+    assert store.get('talossa') == (VoikkoAnalysis.from_voikko(STORE_ANALYSES[1][1][0]),)
+    assert store.get('xyz') == ()
+    assert store.get('kissa') is None
+
+
+def test_analysis_store_serialization(tmp_path):
+    store = AnalysisStore.build(STORE_ANALYSES)
+    store.to_disk(tmp_path / 'analyses.bin')
+    from_disk = AnalysisStore.from_disk(tmp_path / 'analyses.bin')
+    from_bytes = AnalysisStore.from_bytes(store.to_bytes())
+
+    for word, analyses in STORE_ANALYSES:
+        expected = tuple(VoikkoAnalysis.from_voikko(a) for a in analyses)
+        assert from_disk.get(word) == expected
+        assert from_bytes.get(word) == expected
+
+
+def test_lemmatizer_uses_analysis_store(tmp_path):
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=load_lookups(),
+        analysis_store=AnalysisStore.build(STORE_ANALYSES))
+    lemmatizer.to_disk(tmp_path / 'lemmatizer')
+    lemmatizer = VoikkoLemmatizer(nlp.vocab).from_disk(tmp_path / 'lemmatizer')
+
+    doc = Doc(vocab=nlp.vocab, words=['talossa'], pos=['NOUN'])
+    doc = lemmatizer(doc)
+
+    assert len(lemmatizer.analysis_store) == 3
+    assert doc[0].lemma_ == 'talo'
+
+
+def test_pipe_analyzes_each_word_once_per_batch():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, analysis_cache_size=0)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    docs = [
+        Doc(vocab=nlp.vocab, words=['tilassa', 'ja', 'talossa'], pos=['NOUN', 'CCONJ', 'NOUN']),
+        Doc(vocab=nlp.vocab, words=['talossa', 'tilassa', '.'], pos=['NOUN', 'NOUN', 'PUNCT']),
+    ]
+    docs = list(lemmatizer.pipe(docs, batch_size=2))
+
+    assert [t.lemma_ for t in docs[0]] == ['tila', 'ja', 'talo']
+    assert [t.lemma_ for t in docs[1]] == ['talo', 'tila', '.']
+    assert lemmatizer.analysis_cache.misses == 3
+
+
+def create_lemmatizer_pipeline():
+    nlp = FinnishExtended()
+    lemmatizer = nlp.add_pipe('voikko_lemmatizer')
+    lemmatizer.initialize(lookups=load_lookups())
+    return nlp
+
+
+PIPE_TEXTS = [
+    'Hän ajoi punaisella autolla.',
+    'Opettajiimme tuli tietoja tilanteesta.',
+    'Vanhemmaksi tultuaan hän muutti maalle.',
+    'EU:ssa ja BBC:n uutisissa kerrottiin asiasta.',
+] * 10
+
+
+def test_pickle_lemmatizer():
+    nlp = create_lemmatizer_pipeline()
+    unpickled = pickle.loads(pickle.dumps(nlp))
+
+    expected = [[t.lemma_ for t in doc] for doc in nlp.pipe(PIPE_TEXTS)]
+    observed = [[t.lemma_ for t in doc] for doc in unpickled.pipe(PIPE_TEXTS)]
+
+    assert unpickled.get_pipe('voikko_lemmatizer').name == 'voikko_lemmatizer'
+    assert observed == expected
+
+
+def test_multiprocess_pipe():
+    nlp = create_lemmatizer_pipeline()
+
+    expected = [[t.lemma_ for t in doc] for doc in nlp.pipe(PIPE_TEXTS)]
+    observed = [[t.lemma_ for t in doc] for doc in nlp.pipe(PIPE_TEXTS, n_process=4, batch_size=4)]
+
+    assert observed == expected
+
+
+def test_voikko_pool_is_shared_and_opened_lazily():
+    nlp = Finnish()
+    pool = get_voikko_pool()
+    num_handles = pool.num_handles
+    lemmatizer1 = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer2 = VoikkoLemmatizer(nlp.vocab)
+
+    assert lemmatizer1.voikko_pool is pool
+    assert lemmatizer2.voikko_pool is pool
+    assert pool.num_handles == num_handles
+
+
+def test_voikko_pool_threads():
+    pool = VoikkoPool(max_handles=2)
+    words = ['tilassa', 'talossa', 'ja', 'tietoja'] * 25
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        analyses = list(executor.map(pool.analyze, words))
+
+    assert pool.num_handles <= 2
+    assert [a[0]['BASEFORM'] for a in analyses[:4]] == ['tila', 'talo', 'ja', 'tieto']
+    assert analyses[4:8] == analyses[:4]
+
+
+def test_lemmatizer_memoizes_lemmas():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    doc1 = lemmatizer(Doc(vocab=nlp.vocab, words=['tilassa', 'ja'], pos=['NOUN', 'CCONJ']))
+    doc2 = lemmatizer(Doc(vocab=nlp.vocab, words=['tilassa', 'tilassa'], pos=['NOUN', 'VERB']))
+
+    assert [t.lemma_ for t in doc1] == ['tila', 'ja']
+    assert doc2[0].lemma_ == 'tila'
+    assert lemmatizer.lemma_cache.hits == 1
+    assert lemmatizer.lemma_cache.misses == 3
+    assert lemmatizer.analysis_cache.misses == 2
+
+
+def test_lemmatizer_memory_zone():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    with nlp.memory_zone():
+        doc = lemmatizer(Doc(vocab=nlp.vocab, words=['opettajiimme'], pos=['NOUN']))
+        assert doc[0].lemma_ == 'opettaja'
+
+    doc = lemmatizer(Doc(vocab=nlp.vocab, words=['opettajiimme'], pos=['NOUN']))
+
+    assert doc[0].lemma_ == 'opettaja'
+
+
+def test_lemmatize_without_analysis():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    words = ['Ainakin', '€', 'EU:ssa', 'BBC:n', '1,5', '2010']
+    pos = ['ADV', 'SYM', 'PROPN', 'NOUN', 'NUM', 'NUM']
+    doc = lemmatizer(Doc(vocab=nlp.vocab, words=words, pos=pos))
+
+    assert [t.lemma_ for t in doc] == ['ainakin', '€', 'EU', 'BBC', '1,5', '2010']
+    assert lemmatizer.analysis_cache.misses == 0
+
+
+def test_parse_analysis_structure_compound():
+    parsed = parse_analysis_structure(
+        '=ppppp=pppppp', '+kirja(kirja)+kauppa(kauppa)', '[Ln][Xp]kirja[X]kirja[Bh][Bc][Ln][Xp]kauppa[X]kauppa[Sn][Ny]')
+
+    assert parsed.num_bases == 2
+    assert parsed.is_compound
+    assert parsed.wordbases == (WordBase('kirja', 'kirja', 1), WordBase('kauppa', 'kauppa', 1))
+    assert parsed.compound_parts == ('kirja', 'kauppa')
+    assert parsed.minen_stem is None
+
+
+def test_parse_analysis_structure_minen():
+    parsed = parse_analysis_structure(
+        '=pppppppp', '+ajaa(ajaa)+minen(minen)', '[Lt][Xp]ajaa[X]aja[Tn4]mi[Sn][Ny]nen')
+
+    assert parsed.num_bases == 1
+    assert not parsed.is_compound
+    assert parsed.minen_stem == 'aja'
+    assert parsed.ny_baseform is None
+
+
+def test_parse_analysis_structure_missing_fields():
+    parsed = parse_analysis_structure(None, None, None)
+
+    assert parsed.num_bases == 0
+    assert parsed.wordbases == ()
+    assert parsed.compound_parts == ()
+
+
+def create_lemma_table():
+    table = LemmaTable()
+    table.add('talossa', 'NOUN', VoikkoLemmatizer.DEP_OTHER, 'talo')
+    table.add('Talossa', 'NOUN', VoikkoLemmatizer.DEP_OTHER, 'talo')
+    table.add('juoksi', 'VERB', VoikkoLemmatizer.DEP_OTHER, 'juosta')
+    return table
+
+
+def test_lookup_mode():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, mode='lookup')
+    lemmatizer.initialize(lookups=load_lookups(),
+        lemma_table=create_lemma_table())
+
+    words = ['Talossa', 'Kallella', 'Tilassa', 'juoksi', 'meille']
+    pos = ['NOUN', 'PROPN', 'NOUN', 'VERB', 'PRON']
+    doc = lemmatizer(Doc(vocab=nlp.vocab, words=words, pos=pos))
+
+    assert [t.lemma_ for t in doc] == ['talo', 'Kallella', 'tilassa', 'juosta', 'minä']
+    assert lemmatizer.analysis_cache.misses == 0
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        VoikkoLemmatizer(Finnish().vocab, mode='rules')
+
+
+def test_lemma_table_serialization():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, mode='lookup')
+    lemmatizer.initialize(lookups=load_lookups(),
+        lemma_table=create_lemma_table())
+    lemmatizer2 = VoikkoLemmatizer(nlp.vocab, mode='lookup').from_bytes(lemmatizer.to_bytes())
+
+    doc = lemmatizer2(Doc(vocab=nlp.vocab, words=['juoksi'], pos=['VERB']))
+
+    assert len(lemmatizer2.lemma_table) == 3
+    assert doc[0].lemma_ == 'juosta'
+
+
+def test_lemma_table_disambiguation_mismatch():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, mode='lookup', disambiguation='morph')
+
+    with pytest.raises(ValueError):
+        lemmatizer.initialize(lookups=load_lookups(),
+            lemma_table=create_lemma_table())
+
+
+def test_lemma_table_ignored_on_disambiguation_mismatch():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, mode='lookup')
+    lemmatizer.initialize(lookups=load_lookups(),
+        lemma_table=create_lemma_table())
+    data = lemmatizer.to_bytes()
+
+    with pytest.warns(UserWarning):
+        lemmatizer2 = VoikkoLemmatizer(nlp.vocab, mode='lookup', disambiguation='morph').from_bytes(data)
+    lemmatizer3 = VoikkoLemmatizer(nlp.vocab, mode='lookup').from_bytes(data)
+
+    assert lemmatizer2.lemma_table is None
+    assert lemmatizer3.lemma_table.disambiguation == 'dep'
+
+
+def test_lemmatizer_stats():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, collect_stats=True)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    words = ['talossa', 'ja', 'talossa', 'meille', '3', '.']
+    pos = ['NOUN', 'CCONJ', 'NOUN', 'PRON', 'NUM', 'PUNCT']
+    lemmatizer(Doc(vocab=nlp.vocab, words=words, pos=pos))
+    lemmatizer(Doc(vocab=nlp.vocab, words=['talossa'], pos=['NOUN']))
+    stats = lemmatizer.stats()
+
+    assert stats['tokens'] == {
+        'voikko': 3, 'exceptions': 1, 'rules': 1, 'punct': 1, 'lemma_cache': 1
+    }
+    assert stats['voikko_calls'] == 2
+    assert stats['analyses_per_voikko_call'] > 0
+    assert stats['lemma_cache']['hits'] == 1
+
+    lemmatizer.reset_stats()
+    stats = lemmatizer.stats()
+
+    assert stats['tokens'] == {}
+    assert stats['voikko_calls'] == 0
+    assert stats['lemma_cache']['hits'] == 0
+
+
+def test_lemmatizer_stats_disabled_by_default():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    lemmatizer(Doc(vocab=nlp.vocab, words=['talossa'], pos=['NOUN']))
+
+    assert lemmatizer.stats()['tokens'] == {}
+
+
+def test_store_analyses():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, store_analyses=True)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    doc = Doc(vocab=nlp.vocab, words=['taloissa', 'talossa', '.'], pos=['NOUN', 'NOUN', 'PUNCT'])
+    doc = lemmatizer(doc)
+    analysis = doc[0]._.voikko_analysis
+
+    assert analysis.baseform == 'talo'
+    assert analysis.word_class == 'nimisana'
+    assert analysis.sijamuoto == 'sisaolento'
+    assert analysis.number == 'plural'
+    assert doc[1]._.voikko_analysis.number == 'singular'
+    assert doc[2]._.voikko_analysis is None
+
+    doc_bin = DocBin(store_user_data=True, docs=[doc])
+    doc2 = list(DocBin().from_bytes(doc_bin.to_bytes()).get_docs(nlp.vocab))[0]
+
+    assert [t._.voikko_analysis for t in doc2] == [t._.voikko_analysis for t in doc]
+
+
+def test_store_analyses_skips_tokens_lemmatized_without_voikko():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, store_analyses=True)
+    lemmatizer.initialize(lookups=load_lookups())
+    words = ['talossa', 'EU:ssa', '12', '%']
+    pos = ['NOUN', 'PROPN', 'NUM', 'SYM']
+
+    docs = [lemmatizer(Doc(vocab=nlp.vocab, words=words, pos=pos)) for _ in range(2)]
+
+    for doc in docs:
+        assert doc[0]._.voikko_analysis.baseform == 'talo'
+        assert [t._.voikko_analysis for t in doc[1:]] == [None, None, None]
+    assert lemmatizer.analysis_cache.misses == 1
+
+
+def test_vectorized_token_selection():
+    nlp = Finnish()
+    n = 15
+    words = ['kissa', 'ja', 'koira', 'söivät', 'kalaa', '.'] * n
+    pos = ['NOUN', 'CCONJ', 'NOUN', 'VERB', 'NOUN', 'PUNCT'] * n
+    heads = [i + h for i in range(0, 6 * n, 6) for h in [3, 2, 0, 3, 3, 3]]
+    deps = ['nsubj', 'cc', 'conj', 'ROOT', 'obj', 'punct'] * n
+
+    lemmas = []
+    for vectorize_min_tokens in [0, 10**9]:
+        lemmatizer = VoikkoLemmatizer(nlp.vocab)
+        lemmatizer.vectorize_min_tokens = vectorize_min_tokens
+        lemmatizer.initialize(lookups=load_lookups())
+        doc = Doc(nlp.vocab, words=words, pos=pos, heads=heads, deps=deps)
+        doc = lemmatizer(doc)
+        lemmas.append([t.lemma_ for t in doc])
+        keys = set(lemmatizer.lemma_cache._data)
+
+        assert (doc[2].orth, doc[2].pos, VoikkoLemmatizer.DEP_SUBJECT) in keys
+        assert (doc[4].orth, doc[4].pos, VoikkoLemmatizer.DEP_OBJECT) in keys
+
+    assert lemmas[0] == lemmas[1]
+    assert lemmas[0][:6] == ['kissa', 'ja', 'koira', 'syödä', 'kala', '.']
+
+
+def test_incremental_lemmatization():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, incremental=True, collect_stats=True)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    doc = Doc(nlp.vocab, words=['tilassa', 'ja', 'talossa'], pos=['NOUN', 'CCONJ', 'NOUN'])
+    doc = lemmatizer(doc)
+
+    assert [t.lemma_ for t in doc] == ['tila', 'ja', 'talo']
+
+    # A manually corrected lemma is kept because the inputs haven't changed
+    doc[0].lemma_ = 'korjattu'
+    doc[2].pos_ = 'PUNCT'
+    doc = lemmatizer(doc)
+
+    assert [t.lemma_ for t in doc] == ['korjattu', 'ja', 'talossa']
+    assert lemmatizer.stats()['tokens']['changed'] == 1
+
+    # The recorded inputs are serialized in DocBin
+    doc_bin = DocBin(store_user_data=True, docs=[doc])
+    doc = list(DocBin().from_bytes(doc_bin.to_bytes()).get_docs(nlp.vocab))[0]
+    doc[0].pos_ = 'PROPN'
+    doc = lemmatizer(doc)
+
+    assert [t.lemma_ for t in doc] == ['tila', 'ja', 'talossa']
+    assert lemmatizer.stats()['tokens']['changed'] == 2
+
+
+@pytest.mark.parametrize('vectorize_min_tokens', [0, 10**9])
+def test_morph_disambiguation(vectorize_min_tokens):
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, disambiguation='morph')
+    lemmatizer.vectorize_min_tokens = vectorize_min_tokens
+    lemmatizer.initialize(lookups=load_lookups())
+
+    words = ['alusta', 'alusta', 'hauista', 'alusta']
+    pos = ['NOUN', 'NOUN', 'NOUN', 'VERB']
+    morphs = ['Case=Nom|Number=Sing', 'Case=Ela|Number=Sing', 'Case=Par|Number=Plur', '']
+    doc = lemmatizer(Doc(nlp.vocab, words=words, pos=pos, morphs=morphs))
+
+    assert [t.lemma_ for t in doc] == ['alusta', 'alku', 'hauis', 'alustaa']
+
+
+def test_invalid_disambiguation():
+    with pytest.raises(ValueError):
+        VoikkoLemmatizer(Finnish().vocab, disambiguation='parser')
+
+
+def train_edit_tree_lemmatizer(**config):
+    nlp = Finnish()
+    config = {'min_tree_freq': 1, **config}
+    lemmatizer = nlp.add_pipe('fi.confident_edit_tree_lemmatizer', name='edit_tree_lemmatizer', config=config)
+    train_data = [
+        ('kissat söivät kalaa', ['kissa', 'syödä', 'kala']),
+        ('koirat juoksivat talossa', ['koira', 'juosta', 'talo']),
+    ]
+    examples = []
+    for text, lemmas in train_data:
+        doc = nlp.make_doc(text)
+        examples.append(Example.from_dict(doc, {'lemmas': lemmas}))
+    optimizer = nlp.initialize(get_examples=lambda: examples)
+    for _ in range(50):
+        nlp.update(examples, sgd=optimizer)
+    return nlp, lemmatizer
+
+
+def test_edit_tree_lemmatizer_threshold():
+    nlp, lemmatizer = train_edit_tree_lemmatizer(threshold=0.0)
+    doc = nlp('kissat söivät kalaa')
+
+    assert [t.lemma_ for t in doc] == ['kissa', 'syödä', 'kala']
+
+    lemmatizer.threshold = 1.01
+    doc = nlp('kissat söivät kalaa')
+
+    assert [t.lemma for t in doc] == [0, 0, 0]
+
+
+def test_edit_tree_lemmatizer_known_words_only():
+    nlp, lemmatizer = train_edit_tree_lemmatizer(threshold=0.0)
+    lemmatizer2 = nlp.create_pipe('fi.confident_edit_tree_lemmatizer', config={'known_words_only': True})
+    lemmatizer2.from_bytes(lemmatizer.to_bytes())
+    lemmatizer2.threshold = 0.0
+
+    doc = lemmatizer(nlp.make_doc('kissat söivät lohta'))
+    doc2 = lemmatizer2(nlp.make_doc('kissat söivät lohta'))
+
+    assert doc[2].lemma != 0
+    assert [t.lemma for t in doc2] == [doc[0].lemma, doc[1].lemma, 0]
+
+
+def test_hybrid_lemmatizer():
+    nlp, lemmatizer = train_edit_tree_lemmatizer(threshold=0.0, known_words_only=True)
+    voikko_lemmatizer = nlp.add_pipe(
+        'fi.voikko_lemmatizer', name='lemmatizer', config={'collect_stats': True})
+    voikko_lemmatizer.initialize(lookups=load_lookups())
+
+    doc = Doc(nlp.vocab, words=['kissat', 'söivät', 'tilassa'], pos=['NOUN', 'VERB', 'NOUN'])
+    doc = nlp(doc)
+
+    assert [t.lemma_ for t in doc] == ['kissa', 'syödä', 'tila']
+    assert voikko_lemmatizer.stats()['tokens']['voikko'] == 1
+
+
+def test_lemmatize_many():
+    nlp = Finnish()
+    lookups = load_lookups()
+    words = ['talossa', 'ja', 'meille', '3', '.', ':)', 'eu:ssa', 'juoksi', 'talossa']
+    pos = ['NOUN', 'CCONJ', 'PRON', 'NUM', 'PUNCT', 'SYM', 'PROPN', 'VERB', 'NOUN']
+
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, collect_stats=True)
+    lemmatizer.initialize(lookups=lookups)
+    lemmas = list(lemmatizer.lemmatize_many(iter(words), iter(pos), batch_size=4))
+
+    expected_lemmatizer = VoikkoLemmatizer(nlp.vocab)
+    expected_lemmatizer.initialize(lookups=lookups)
+    expected = [
+        expected_lemmatizer(Doc(nlp.vocab, words=[w], pos=[p], deps=['ROOT']))[0].lemma_
+        for w, p in zip(words, pos)
+    ]
+
+    assert lemmas == expected
+    assert lemmas[:3] == ['talo', 'ja', 'minä']
+    assert lemmatizer.stats()['tokens']['lemma_cache'] == 1
+
+
+def test_lemmatize_many_invalid_input():
+    lemmatizer = VoikkoLemmatizer(Finnish().vocab)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    with pytest.raises(ValueError):
+        list(lemmatizer.lemmatize_many(['talossa', 'ja'], ['NOUN']))
+    with pytest.raises(ValueError):
+        list(lemmatizer.lemmatize_many(['talossa'], ['NOUNS']))
+
+
+def test_guarded_tokens_are_not_analyzed():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, collect_stats=True, max_word_length=20)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    words = ['talossa', 'a' * 21, 'ab-cd-ef-gh-ij-talossa', '#talossa', 'aGVsbG8=', 'b' * 21]
+    pos = ['NOUN', 'NOUN', 'NOUN', 'NOUN', 'X', 'PROPN']
+    doc = lemmatizer(Doc(nlp.vocab, words=words, pos=pos))
+
+    assert [t.lemma_ for t in doc] == ['talo', 'a' * 21, 'ab-cd-ef-gh-ij-talossa',
+                                       '#talossa', 'aGVsbG8=', 'b' * 21]
+    assert lemmatizer.stats()['tokens'] == {'voikko': 1, 'guarded': 5}
+    assert lemmatizer.stats()['voikko_calls'] == 1
+    assert len(lemmatizer.lemma_cache) == 1
+
+
+def test_guards_apply_to_the_whole_hyphenated_word():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, collect_stats=True)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    words = ['#tag-talossa', '@user-nimi', 'http://x.fi/some-page']
+    pos = ['NOUN', 'PROPN', 'X']
+    doc = lemmatizer(Doc(nlp.vocab, words=words, pos=pos))
+
+    assert [t.lemma_ for t in doc] == words
+    assert lemmatizer.stats()['tokens'] == {'guarded': 3}
+    assert lemmatizer.stats()['voikko_calls'] == 0
+
+
+def test_guards_can_be_disabled():
+    nlp = Finnish()
+    lemmatizer = VoikkoLemmatizer(nlp.vocab, collect_stats=True, max_word_length=0,
+                                  max_hyphen_parts=0, guard_pattern=None)
+    lemmatizer.initialize(lookups=load_lookups())
+
+    doc = lemmatizer(Doc(nlp.vocab, words=['ab-cd-ef-gh-ij-talossa'], pos=['NOUN']))
+
+    assert doc[0].lemma_ == 'ab-cd-ef-gh-ij-talo'
+    assert 'guarded' not in lemmatizer.stats()['tokens']
@@ -1,6 +1,9 @@
+import numpy
 import pytest
-from fi import FinnishExtended
-from util import get_doc_from_text
+import fi.fi
+from fi import FinnishExtended, NounChunker
+from spacy.tokens import Doc, DocBin
+from util import get_doc, get_doc_from_text
 
 fi_nlp = FinnishExtended()
 fi_tokenizer = fi_nlp.tokenizer
@@ -224,3 +227,136 @@ def test_fi_noun_chunks_multiple_sentences(text, pos, deps, heads, expected_noun
         assert len(noun_chunks) == len(expected)
         for i, np in enumerate(noun_chunks):
             assert np.text == expected[i]
+
+
+@pytest.mark.parametrize(
+    "text,pos,deps,heads,expected_noun_chunks", FI_NP_TEST_EXAMPLES_MULTI_SENTENCE
+)
+def test_fi_noun_chunks_iterator_on_sentences(text, pos, deps, heads, expected_noun_chunks):
+    doc = get_doc_from_text(text, fi_tokenizer, pos=pos, heads=heads, deps=deps)
+    structure = fi.fi._noun_chunk_structure(doc.to_array(['POS', 'DEP', 'HEAD']))
+
+    for s in doc.sents:
+        expected = fi.fi._noun_chunk_bounds(
+            lambda i: doc[i].left_edge.i, structure, 0, s.start, s.end)
+        assert [(start, end) for start, end, _ in fi.fi.noun_chunks(s)] == list(expected)
+
+
+def test_fi_noun_chunks_after_parse_change():
+    text, pos, deps, heads, expected_noun_chunks = FI_NP_TEST_EXAMPLES[0]
+    doc = get_doc_from_text(text, fi_tokenizer, pos=pos, heads=heads, deps=deps)
+
+    assert [np.text for np in doc.noun_chunks] == expected_noun_chunks
+    doc[4].dep_ = 'advmod'
+    assert [np.text for np in doc.noun_chunks] == expected_noun_chunks[:1]
+
+
+@pytest.mark.parametrize(
+    "text,pos,deps,heads,expected_noun_chunks", FI_NP_TEST_EXAMPLES
+)
+def test_fi_noun_chunks_vectorized(monkeypatch, text, pos, deps, heads, expected_noun_chunks):
+    monkeypatch.setattr(fi.fi, 'NOUN_CHUNKS_VECTORIZE_MIN_TOKENS', 0)
+    doc = get_doc_from_text(text, fi_tokenizer, pos=pos, heads=heads, deps=deps)
+    noun_chunks = list(doc.noun_chunks)
+
+    assert [np.text for np in noun_chunks] == expected_noun_chunks
+
+
+def test_fi_noun_chunks_long_nmod_chain():
+    n = 5000
+    words = ['sana'] * n
+    pos = ['NOUN'] * n
+    deps = ['obj'] + ['nmod'] * (n - 1)
+    heads = [0] + [-1] * (n - 1)
+    doc = get_doc(fi_nlp.vocab, words=words, pos=pos, heads=heads, deps=deps)
+    noun_chunks = list(doc.noun_chunks)
+
+    assert [(np.start, np.end) for np in noun_chunks] == [(0, n)]
+
+
+def get_example_docs():
+    return [
+        get_doc_from_text(text, fi_tokenizer, pos=pos, heads=heads, deps=deps)
+        for text, pos, deps, heads, _ in FI_NP_TEST_EXAMPLES
+    ]
+
+
+@pytest.mark.parametrize('vectorize_min_tokens', [0, 10**9])
+def test_noun_chunker(monkeypatch, vectorize_min_tokens):
+    monkeypatch.setattr(fi.fi, 'NOUN_CHUNKS_VECTORIZE_MIN_TOKENS', vectorize_min_tokens)
+    noun_chunker = NounChunker(fi_nlp.vocab)
+    docs = [Doc(fi_nlp.vocab, words=[])] + get_example_docs()
+    docs = list(noun_chunker.pipe(docs, batch_size=4))
+
+    assert list(docs[0].spans['noun_chunks']) == []
+    for doc, (_, _, _, _, expected_noun_chunks) in zip(docs[1:], FI_NP_TEST_EXAMPLES):
+        spans = doc.spans['noun_chunks']
+        assert [span.text for span in spans] == expected_noun_chunks
+        assert [span.label_ for span in spans] == ['NP'] * len(spans)
+
+    doc_bin = DocBin(docs=docs)
+    docs2 = list(DocBin().from_bytes(doc_bin.to_bytes()).get_docs(fi_nlp.vocab))
+
+    assert [[s.text for s in d.spans['noun_chunks']] for d in docs2] == \
+        [[s.text for s in d.spans['noun_chunks']] for d in docs]
+
+
+def test_noun_chunker_requires_parse():
+    noun_chunker = NounChunker(fi_nlp.vocab)
+    with pytest.raises(ValueError):
+        noun_chunker(Doc(fi_nlp.vocab, words=['Kaksi', 'tyttöä']))
+
+
+def test_noun_chunk_arrays():
+    noun_chunker = NounChunker(fi_nlp.vocab)
+    docs = get_example_docs()
+    # Stored noun chunks are used as they are
+    docs[1] = noun_chunker(docs[1])
+    docs[1].spans['noun_chunks'] = [docs[1].spans['noun_chunks'][0]]
+
+    doc_indices, starts, ends = noun_chunker.noun_chunk_arrays(iter(docs), batch_size=3)
+
+    expected = [(i, np.start, np.end) for i, doc in enumerate(docs) for np in doc.noun_chunks]
+    del expected[3]
+    assert list(zip(doc_indices.tolist(), starts.tolist(), ends.tolist())) == expected
+    assert doc_indices.dtype == starts.dtype == ends.dtype == numpy.int64
+
+
+def test_doc_bin_noun_chunks(tmp_path):
+    docs = get_example_docs()
+    docs.insert(2, Doc(fi_nlp.vocab, words=[]))
+    for text, pos, deps, heads, _ in FI_NP_TEST_EXAMPLES_MULTI_SENTENCE:
+        docs.append(get_doc_from_text(text, fi_tokenizer, pos=pos, heads=heads, deps=deps))
+    path = tmp_path / 'docs.spacy'
+    DocBin(docs=docs).to_disk(path)
+
+    expected = [
+        (i, np.start, np.end)
+        for i, doc in enumerate(DocBin().from_disk(path).get_docs(fi_nlp.vocab))
+        for np in doc.noun_chunks
+    ]
+    for batch_size in [1, 3, 1000]:
+        results = list(fi.fi.doc_bin_noun_chunks([path, DocBin().from_disk(path)], batch_size=batch_size))
+
+        assert len(results) == 2
+        for doc_indices, starts, ends in results:
+            assert list(zip(doc_indices.tolist(), starts.tolist(), ends.tolist())) == expected
+
+
+def test_doc_bin_noun_chunks_requires_parse():
+    doc_bin = DocBin(docs=[Doc(fi_nlp.vocab, words=['Kaksi', 'tyttöä'])])
+    with pytest.raises(ValueError):
+        list(fi.fi.doc_bin_noun_chunks([doc_bin]))
+
+
+def test_doc_bin_left_edges_non_projective():
+    # The left edges of a non-projective parse are not always the first
+    # tokens of the subtrees
+    heads = [0, 4, 1, 1, -4, -3]
+    doc = get_doc(fi_nlp.vocab, words=['sana'] * 6, pos=['NOUN'] * 6, heads=heads,
+                  deps=['ROOT', 'nummod', 'nsubj', 'nmod', 'nummod', 'nmod'])
+    abs_heads = numpy.arange(len(heads)) + numpy.array(heads)
+    left_edges = fi.fi._left_edges(abs_heads, numpy.array([len(doc)]), numpy.zeros(len(doc), dtype=int))
+
+    assert left_edges.tolist() == [t.left_edge.i for t in doc]
+    assert left_edges.tolist() != [min(x.i for x in t.subtree) for t in doc]
@@ -1,10 +1,21 @@
+import pickle
+import re
+import sys
 import pytest
+from pathlib import Path
 from textwrap import dedent
-from fi.fi import FinnishExtended
+from spacy import util
+from spacy.tokenizer import Tokenizer
+import fi.fi
+from fi.fi import AffixMatcher, AffixTable, FinnishExtended, compile_cached_regex
+from benchmarks.sample import read_sample
+from tools.create_affix_table import read_chunks
 
 fi_nlp = FinnishExtended()
 fi_tokenizer = fi_nlp.tokenizer
 
+VOCABULARY_PATH = Path(__file__).parent.parent.parent / 'data' / 'word_frequencies' / 'finnish_vocab.txt.gz'
+
 FI_TOKENIZER_TEST_EXAMPLES = [
     (
         'Nopeusrajoitus on 120km/h!',
@@ -131,3 +142,213 @@ def test_fi_tokenizer_xfail(text, expected_tokens):
     tokens = tokenize(text)
 
     assert tokens == expected_tokens
+
+
+@pytest.mark.parametrize(
+    "entries,compile_regex",
+    [
+        (FinnishExtended.Defaults.prefixes, util.compile_prefix_regex),
+        (FinnishExtended.Defaults.suffixes, util.compile_suffix_regex),
+        (FinnishExtended.Defaults.infixes, util.compile_infix_regex),
+    ]
+)
+@pytest.mark.skipif(sys.version_info < (3, 11), reason='The disk cache requires Python 3.11')
+def test_compile_cached_regex(monkeypatch, tmp_path, entries, compile_regex):
+    monkeypatch.setenv('SPACYFI_CACHE_DIR', str(tmp_path))
+    expected = compile_regex(entries)
+
+    compile_cached_regex.cache_clear()
+    compiled = compile_cached_regex(expected.pattern)
+    cache_files = list(tmp_path.glob('regex-*.msgpack'))
+    assert len(cache_files) == 1
+
+    # Loaded from the disk cache
+    compile_cached_regex.cache_clear()
+    cached = compile_cached_regex(expected.pattern)
+
+    # A broken cache file is replaced
+    cache_files[0].write_bytes(b'broken')
+    compile_cached_regex.cache_clear()
+    recompiled = compile_cached_regex(expected.pattern)
+    compile_cached_regex.cache_clear()
+
+    assert compiled == expected
+    assert cached == expected
+    assert recompiled == expected
+    assert cache_files[0].read_bytes() != b'broken'
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 11), reason='The disk cache is used on Python 3.11')
+def test_compile_cached_regex_fallback(monkeypatch, tmp_path):
+    monkeypatch.setenv('SPACYFI_CACHE_DIR', str(tmp_path))
+    expected = util.compile_suffix_regex(FinnishExtended.Defaults.suffixes)
+
+    compile_cached_regex.cache_clear()
+    compiled = compile_cached_regex(expected.pattern)
+    compile_cached_regex.cache_clear()
+
+    assert compiled == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_compile_cached_regex_disabled_by_default(monkeypatch, tmp_path):
+    monkeypatch.delenv('SPACYFI_CACHE_DIR', raising=False)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+    compile_cached_regex.cache_clear()
+    FinnishExtended()
+    compile_cached_regex.cache_clear()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.skipif(sys.version_info < (3, 11), reason='The disk cache requires Python 3.11')
+def test_compile_cached_regex_pruning(monkeypatch, tmp_path):
+    monkeypatch.setenv('SPACYFI_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(fi.fi, 'REGEX_CACHE_MAX_FILES', 2)
+    other_version = tmp_path / 'regex-0123456789abcdef-0000.msgpack'
+    other_version.write_bytes(b'')
+
+    compile_cached_regex.cache_clear()
+    for expression in ['a+', 'b+', 'c+']:
+        compile_cached_regex(expression)
+    compile_cached_regex.cache_clear()
+
+    assert not other_version.exists()
+    assert len(list(tmp_path.glob('regex-*.msgpack'))) == 2
+
+
+def test_cached_tokenizer(monkeypatch, tmp_path):
+    monkeypatch.setenv('SPACYFI_CACHE_DIR', str(tmp_path))
+    compile_cached_regex.cache_clear()
+    FinnishExtended()
+    compile_cached_regex.cache_clear()
+    tokenizer = FinnishExtended().tokenizer
+    compile_cached_regex.cache_clear()
+
+    for text, expected_tokens in FI_TOKENIZER_TEST_EXAMPLES:
+        assert [t.orth_ for t in tokenizer(text)] == expected_tokens
+
+
+def build_affix_table():
+    chunks = [chunk for text, _ in FI_TOKENIZER_TEST_EXAMPLES for chunk in text.split()]
+    return AffixTable.build(FinnishExtended().tokenizer, chunks)
+
+
+def test_affix_table():
+    affix_table = build_affix_table()
+    tokenizer = FinnishExtended().tokenizer
+    tokenizer.affix_table = affix_table
+
+    assert len(affix_table) > 0
+    assert 'Nopeusrajoitus' in affix_table.index()
+    for text, expected_tokens in FI_TOKENIZER_TEST_EXAMPLES + FI_TOKENIZER_XFAIL_EXAMPLES:
+        assert [t.orth_ for t in tokenizer(text)] == tokenize(text)
+        assert tokenizer.explain(text) == fi_tokenizer.explain(text)
+
+
+def test_affix_table_serialization():
+    tokenizer = FinnishExtended().tokenizer
+    tokenizer.affix_table = build_affix_table()
+
+    from_bytes = FinnishExtended().tokenizer.from_bytes(tokenizer.to_bytes())
+    unpickled = pickle.loads(pickle.dumps(tokenizer))
+
+    for t in [from_bytes, unpickled]:
+        assert t.affix_table.to_bytes() == tokenizer.affix_table.to_bytes()
+        assert t.to_bytes() == tokenizer.to_bytes()
+        for text, expected_tokens in FI_TOKENIZER_TEST_EXAMPLES:
+            assert [x.orth_ for x in t(text)] == expected_tokens
+
+
+def test_affix_table_other_expressions():
+    # The table is not used for expressions that it wasn't built for
+    tokenizer = FinnishExtended().tokenizer
+    tokenizer.suffix_search = re.compile(r'[.,!?]$').search
+    tokenizer.affix_table = build_affix_table()
+
+    assert isinstance(tokenizer.suffix_search.__self__, re.Pattern)
+    assert not isinstance(tokenizer.prefix_search.__self__, re.Pattern)
+    assert [t.orth_ for t in tokenizer('hiilivoimalan.Parlamentti.')] == \
+        ['hiilivoimalan', '.', 'Parlamentti', '.']
+
+
+def regex_tokenizer(nlp):
+    defaults = nlp.Defaults
+    return Tokenizer(
+        nlp.vocab,
+        rules=defaults.tokenizer_exceptions,
+        prefix_search=util.compile_prefix_regex(defaults.prefixes).search,
+        suffix_search=util.compile_suffix_regex(defaults.suffixes).search,
+        infix_finditer=util.compile_infix_regex(defaults.infixes).finditer,
+        token_match=defaults.token_match,
+        url_match=defaults.url_match,
+    )
+
+
+@pytest.mark.parametrize(
+    "kind,entries,compile_regex",
+    [
+        ('prefix', FinnishExtended.Defaults.prefixes, util.compile_prefix_regex),
+        ('suffix', FinnishExtended.Defaults.suffixes, util.compile_suffix_regex),
+        ('infix', FinnishExtended.Defaults.infixes, util.compile_infix_regex),
+    ]
+)
+def test_affix_matcher(kind, entries, compile_regex):
+    matcher = AffixMatcher(kind, entries, warmup_calls=10)
+    regex = compile_regex(entries)
+    texts = [text for text, _ in FI_TOKENIZER_TEST_EXAMPLES + FI_TOKENIZER_XFAIL_EXAMPLES]
+    texts += ['', '..', 'sana...', '20°C.', '5km²', 'x\n', '\U0001F600a', 'a-\u2014b']
+
+    assert matcher.pattern == regex.pattern
+    for text in texts:
+        for string in {text[i:j] for i in range(len(text)) for j in range(i, len(text) + 1)}:
+            if kind == 'infix':
+                assert [m.span() for m in matcher.finditer(string)] == \
+                    [m.span() for m in regex.finditer(string)], string
+            else:
+                expected = regex.search(string)
+                m = matcher.search(string)
+                assert (m and m.span()) == (expected and expected.span()), string
+
+
+def test_affix_matcher_tokenizer():
+    nlp = FinnishExtended()
+    tokenizer = util.registry.tokenizers.get('spacyfi.Tokenizer.v1')(warmup_calls=0)(nlp)
+    reference = regex_tokenizer(nlp)
+    unpickled = pickle.loads(pickle.dumps(tokenizer))
+
+    for text, _ in FI_TOKENIZER_TEST_EXAMPLES + FI_TOKENIZER_XFAIL_EXAMPLES:
+        expected = [t.orth_ for t in reference(text)]
+        assert [t.orth_ for t in tokenizer(text)] == expected
+        assert [t.orth_ for t in unpickled(text)] == expected
+        assert tokenizer.explain(text) == reference.explain(text)
+
+
+def assert_same_tokens(texts):
+    nlp = FinnishExtended()
+    tokenizer = util.registry.tokenizers.get('spacyfi.Tokenizer.v1')(warmup_calls=0)(nlp)
+    reference = regex_tokenizer(nlp)
+
+    mismatches = [
+        text for text in texts
+        if [t.orth_ for t in tokenizer(text)] != [t.orth_ for t in reference(text)]
+    ]
+    assert mismatches == []
+
+
+def test_affix_matcher_tokenizer_on_sample():
+    sentences = read_sample()
+    words = {w for s in sentences for w in s.words}
+    punctuation = '.,:;!?()[]"\'-–—…/%€'
+    texts = [s.text for s in sentences]
+    texts += [w + p for w in words for p in punctuation]
+    texts += [p + w for w in words for p in punctuation]
+
+    assert_same_tokens(texts)
+
+
+@pytest.mark.skipif(not VOCABULARY_PATH.exists(), reason='The word frequency list has not been downloaded')
+def test_affix_matcher_tokenizer_on_vocabulary():
+    assert_same_tokens(read_chunks(VOCABULARY_PATH, 20000, '.,'))
@@ -0,0 +1,46 @@
+"""Precompute the tokenizer affix matches of the most frequent chunks."""
+
+import gzip
+import typer
+from pathlib import Path
+from itertools import islice
+from typing import List
+from fi import FinnishExtended
+from fi.fi import AffixTable
+from .create_lexdata import is_valid_token, parse_token_line
+
+
+def main(
+    full_vocabulary_path: Path = typer.Argument(..., help='Path to the full vocabulary'),
+    output_path: Path = typer.Argument(..., help='Name of the output file'),
+    num_tokens: int = typer.Argument(..., help='Number of most frequent tokens to include'),
+    punctuation: str = typer.Option(
+        '.,', help='Add chunks where each token is followed by one of these characters'),
+):
+    chunks = read_chunks(full_vocabulary_path, num_tokens, punctuation)
+    table = AffixTable.build(FinnishExtended().tokenizer, chunks)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_disk(output_path)
+
+    print(f'Wrote affix matches of {len(table)} strings to {output_path}')
+
+
+def read_chunks(full_loc: Path, num_tokens: int, punctuation: str = '') -> List[str]:
+    """Read the most frequent tokens. The frequency list has tokens, but
+    a token is often followed by a comma or a period in the same
+    whitespace-delimited chunk, so those variants are added, too.
+    """
+    chunks = []
+    with gzip.open(full_loc, 'rt', encoding='utf-8') as f:
+        parsed = (parse_token_line(x) for x in f)
+        valid_tokens = (x for x in parsed if is_valid_token(x[1]))
+        for _, token in islice(valid_tokens, num_tokens):
+            chunks.append(token)
+            chunks.extend(token + p for p in punctuation)
+
+    return chunks
+
+
+if __name__ == '__main__':
+    typer.run(main)
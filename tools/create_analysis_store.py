@@ -0,0 +1,43 @@
+"""Precompute Voikko analyses of the most frequent words for the lemmatizer."""
+
+import gzip
+import libvoikko
+import typer
+from pathlib import Path
+from itertools import islice
+from fi.fi import AnalysisStore
+from .create_lexdata import is_valid_token, parse_token_line
+
+
+def main(
+    full_vocabulary_path: Path = typer.Argument(..., help='Path to the full vocabulary'),
+    output_path: Path = typer.Argument(..., help='Name of the output file'),
+    num_tokens: int = typer.Argument(..., help='Number of most frequent tokens to analyze'),
+):
+    voikko = libvoikko.Voikko('fi')
+    words = read_words(full_vocabulary_path, num_tokens)
+    store = AnalysisStore.build((w, voikko.analyze(w)) for w in words)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    store.to_disk(output_path)
+
+    print(f'Wrote analyses of {len(store)} words to {output_path}')
+
+
+def read_words(full_loc, num_tokens):
+    words = set()
+    with gzip.open(full_loc, 'rt', encoding='utf-8') as f:
+        parsed = (parse_token_line(x) for x in f)
+        valid_tokens = (x for x in parsed if is_valid_token(x[1]))
+        for _, token in islice(valid_tokens, num_tokens):
+            # The lemmatizer analyzes only the last part of a hyphenated
+            # compound word. See VoikkoLemmatizer._analyze()
+            if '-' in token and token[-1] != '-':
+                token = token.rsplit('-', 1)[-1]
+            words.add(token)
+
+    return sorted(words)
+
+
+if __name__ == '__main__':
+    typer.run(main)
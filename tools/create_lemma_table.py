@@ -0,0 +1,64 @@
+"""Precompute lemmas of frequent words for the lookup mode of the lemmatizer.
+
+Runs the Voikko-based lemmatizer of a trained model over a corpus and
+writes the lemmas of the frequent (word, POS, dependency class) triples
+into a table that is loaded into the lemmatizer when a pipeline is
+assembled.
+"""
+
+import json
+import spacy
+import typer
+from collections import Counter
+from itertools import islice
+from pathlib import Path
+from tqdm import tqdm
+from fi.fi import LemmaTable
+from .io import open_input
+
+
+def main(
+    model_path: Path = typer.Argument(..., help='Path to the trained model'),
+    corpus_path: Path = typer.Argument(..., help='Path to a JSONL corpus'),
+    output_path: Path = typer.Argument(..., help='Path of the output lemma table'),
+    max_texts: int = typer.Option(200000, help='Number of texts to process'),
+    min_count: int = typer.Option(3, help='Minimum frequency of a stored triple'),
+    n_process: int = typer.Option(1, help='Number of processes'),
+    disambiguation: str = typer.Option('dep', help='Disambiguation mode of the lemmatizer: dep or morph'),
+):
+    lemmatizer_config = {'mode': 'voikko', 'disambiguation': disambiguation}
+    # The parser is not needed when nominals are classified by the case
+    exclude = ['parser'] if disambiguation == 'morph' else []
+    nlp = spacy.load(model_path, exclude=exclude,
+                     config={'components': {'lemmatizer': lemmatizer_config}})
+    lemmatizer = nlp.get_pipe('lemmatizer')
+    # Drop a previously created table so that all lemmas come from Voikko
+    lemmatizer.initialize(lookups=lemmatizer.lookups, analysis_store=lemmatizer.analysis_store)
+
+    counts = Counter()
+    lemmas = {}
+    with open_input(corpus_path) as f:
+        texts = (json.loads(line)['text'] for line in islice(f, max_texts))
+        for doc in tqdm(nlp.pipe(texts, n_process=n_process), total=max_texts):
+            for token in doc:
+                if token.pos_ in ('PUNCT', 'SPACE'):
+                    continue
+
+                key = (token.orth_, token.pos_, lemmatizer.dep_class(token))
+                counts[key] += 1
+                lemmas[key] = token.lemma_
+
+    table = LemmaTable(disambiguation)
+    for key, count in counts.most_common():
+        if count < min_count:
+            break
+        table.add(*key, lemmas[key])
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    table.to_disk(output_path)
+
+    print(f'Wrote lemmas of {len(table)} words to {output_path}')
+
+
+if __name__ == '__main__':
+    typer.run(main)
@@ -0,0 +1,77 @@
+"""Compare the accuracy and the speed of the lemmatizer modes.
+
+With --hybrid-model, evaluate also a pipeline where an edit tree
+lemmatizer precedes the Voikko lemmatizer, and report the fraction of
+tokens that are still lemmatized by the Voikko lemmatizer.
+"""
+
+import json
+import spacy
+import typer
+from pathlib import Path
+from typing import List, Optional
+from spacy.training import Corpus
+import fi  # noqa: F401  Registers the lemmatizer factory
+
+
+def main(
+    model_path: Path = typer.Argument(..., help='Path to the trained model'),
+    data_path: Path = typer.Argument(..., help='Path to the evaluation data (.spacy)'),
+    output_path: Path = typer.Argument(..., help='Name of the output JSON file'),
+    modes: List[str] = typer.Option(['voikko', 'lookup'], '--mode', help='Lemmatizer modes to evaluate'),
+    parser_free: bool = typer.Option(
+        False, help='Evaluate each mode also without the parser, using the morph disambiguation'),
+    hybrid_model_path: Optional[Path] = typer.Option(
+        None, '--hybrid-model', help='Path to a model with an edit tree lemmatizer'),
+    thresholds: List[float] = typer.Option(
+        [0.5, 0.7, 0.9, 0.95, 0.99], '--threshold',
+        help='Confidence thresholds of the edit tree lemmatizer to evaluate'),
+):
+    variants = [(mode, mode, 'dep', []) for mode in modes]
+    if parser_free:
+        variants.extend((f'{mode}-parser-free', mode, 'morph', ['parser']) for mode in modes)
+
+    results = {}
+    for name, mode, disambiguation, exclude in variants:
+        lemmatizer_config = {'mode': mode, 'disambiguation': disambiguation}
+        nlp = spacy.load(model_path, exclude=exclude,
+                         config={'components': {'lemmatizer': lemmatizer_config}})
+        examples = list(Corpus(data_path)(nlp))
+        scores = nlp.evaluate(examples)
+        results[name] = {
+            'pipeline': nlp.pipe_names,
+            'lemma_acc': scores['lemma_acc'],
+            'words_per_second': scores['speed'],
+        }
+        print(f'{name}: lemma_acc {scores["lemma_acc"]:.4f}, {scores["speed"]:.0f} words/s')
+
+    if hybrid_model_path is not None:
+        for threshold in thresholds:
+            name = f'hybrid-{threshold}'
+            nlp = spacy.load(hybrid_model_path, config={'components': {
+                'edit_tree_lemmatizer': {'threshold': threshold},
+                'lemmatizer': {'collect_stats': True},
+            }})
+            examples = list(Corpus(data_path)(nlp))
+            scores = nlp.evaluate(examples)
+            num_tokens = sum(len(eg.predicted) for eg in examples)
+            tokens = nlp.get_pipe('lemmatizer').stats()['tokens']
+            fallback = sum(n for source, n in tokens.items() if source not in ('punct', 'changed'))
+            results[name] = {
+                'pipeline': nlp.pipe_names,
+                'threshold': threshold,
+                'lemma_acc': scores['lemma_acc'],
+                'words_per_second': scores['speed'],
+                'voikko_lemmatizer_fraction': fallback / num_tokens,
+                'voikko_analysis_fraction': tokens.get('voikko', 0) / num_tokens,
+            }
+            print(f'{name}: lemma_acc {scores["lemma_acc"]:.4f}, {scores["speed"]:.0f} words/s, '
+                  f'{fallback / num_tokens:.1%} of tokens lemmatized by Voikko')
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    typer.run(main)
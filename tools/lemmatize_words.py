@@ -0,0 +1,61 @@
+"""Lemmatize a list of words with the lemmatizer of a trained model.
+
+The input is a TSV file with a word and its universal POS tag on each
+line. The lemma is appended to each line as a new column. Lines without
+a POS tag are skipped with a warning. Use - to read from stdin or to
+write to stdout.
+
+Example:
+
+    cut -f 2,4 words.conllu | python -m tools.lemmatize_words training/merged - lemmas.tsv
+"""
+
+import spacy
+import sys
+import typer
+from itertools import tee
+from pathlib import Path
+from spacy import util
+from .io import open_input, open_output
+import fi  # noqa: F401  Registers the lemmatizer factory
+
+
+def main(
+    model_path: Path = typer.Argument(..., help='Path to the trained model'),
+    input_path: Path = typer.Argument(..., help='Input TSV file with word and POS columns'),
+    output_path: Path = typer.Argument(..., help='Name of the output TSV file'),
+    batch_size: int = typer.Option(10000, help='Number of words to lemmatize at a time'),
+):
+    # Only the lemmatizer is needed
+    pipeline = util.load_config(model_path / 'config.cfg')['nlp']['pipeline']
+    nlp = spacy.load(model_path, exclude=[x for x in pipeline if x != 'lemmatizer'])
+    lemmatizer = nlp.get_pipe('lemmatizer')
+
+    skipped = []
+    with open_input(input_path) as inf, open_output(output_path) as outf:
+        words, pos_tags, rows = tee(read_rows(inf, skipped), 3)
+        lemmas = lemmatizer.lemmatize_many((row[0] for row in words),
+                                           (row[1] for row in pos_tags),
+                                           batch_size=batch_size)
+        for row, lemma in zip(rows, lemmas):
+            outf.write('\t'.join(row + [lemma]) + '\n')
+
+    if skipped:
+        print(f'Warning: skipped {len(skipped)} lines without a POS tag '
+              f'(first on line {skipped[0]})', file=sys.stderr)
+
+
+def read_rows(f, skipped):
+    """Yield the rows that have a POS tag. The line numbers of the other
+    rows are appended to skipped.
+    """
+    for i, line in enumerate(f, start=1):
+        row = line.rstrip('\n').split('\t')
+        if len(row) < 2 or not row[1]:
+            skipped.append(i)
+            continue
+        yield row
+
+
+if __name__ == '__main__':
+    typer.run(main)
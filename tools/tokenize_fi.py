@@ -3,22 +3,32 @@ from multiprocessing import Pool
 from pathlib import Path
 from typing import Optional, Tuple
 from fi import FinnishExtended
+from fi.fi import AffixTable
 from .io import open_input, open_output
 
 
-def main(input_dir: Path, output_dir: Path, threads: Optional[int] = 4):
+def main(
+    input_dir: Path,
+    output_dir: Path,
+    threads: Optional[int] = 4,
+    affix_table: Optional[Path] = typer.Option(
+        None, help='Affix table created by tools.create_affix_table'),
+):
     input_files = input_dir.iterdir()
-    inputs_and_outputs = [(p, output_dir / uncompressed_file_name(p)) for p in input_files]
+    inputs_and_outputs = [
+        (p, output_dir / uncompressed_file_name(p), affix_table) for p in input_files
+    ]
 
     with Pool(threads) as pool:
         for output_file in pool.imap_unordered(tokenize_file, inputs_and_outputs, chunksize=1):
             print(f'Wrote {output_file}')
 
 
-def tokenize_file(paths: Tuple[Path, Path]):
-    input_file, output_file = paths
+def tokenize_file(paths: Tuple[Path, Path, Optional[Path]]):
+    input_file, output_file, affix_table_path = paths
+    affix_table = AffixTable.from_disk(affix_table_path) if affix_table_path else None
     with open_input(input_file) as inf, open_output(output_file) as outf:
-        tokenizer = create_tokenizer()
+        tokenizer = create_tokenizer(affix_table)
 
         for i, line in enumerate(inf):
             line = line.rstrip('\n')
@@ -30,13 +40,16 @@ def tokenize_file(paths: Tuple[Path, Path]):
                 # This will leak memory unless the tokenizer is re-created
                 # periodically
                 del tokenizer
-                tokenizer = create_tokenizer()
+                tokenizer = create_tokenizer(affix_table)
 
     return output_file
 
 
-def create_tokenizer():
-    return FinnishExtended().tokenizer
+def create_tokenizer(affix_table: Optional[AffixTable] = None):
+    tokenizer = FinnishExtended().tokenizer
+    if affix_table is not None:
+        tokenizer.affix_table = affix_table
+    return tokenizer
 
 
 def uncompressed_file_name(input_file: Path):